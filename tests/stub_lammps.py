@@ -0,0 +1,42 @@
+import json
+import numpy as np
+
+# Three atoms in a 10 x 12 x 14 box, with image flags of -1 to 2 periods
+BOXLO = [0.0, 0.0, 0.0]
+BOXHI = [10.0, 12.0, 14.0]
+IMAGES = [(0, 0, 0), (1, -1, 0), (0, 2, -1)]
+STATE = {
+    "id": [3, 1, 2],
+    "x": [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0], [7.0, 8.0, 9.0]],
+    "v": [[0.3, 0.3, 0.3], [0.1, 0.1, 0.1], [0.2, 0.2, 0.2]],
+    "image": [(ix + 512) | (iy + 512) << 10 | (iz + 512) << 20 for ix, iy, iz in IMAGES],
+}
+
+
+class StubLammps:
+    """Stand-in for lammps.lammps: the input file holds the final state as JSON
+
+    It lives in its own module so that the worker process of library.run_file
+    can import it without RDKit.
+    """
+    def __init__(self, cmdargs=None):
+        self.cmdargs = cmdargs
+        self.numpy = self
+        self.state = None
+
+    def file(self, path):
+        # Relative to the working directory of the run
+        with open(path) as f:
+            self.state = json.load(f)
+
+    def extract_global(self, name):
+        return len(self.state["id"])
+
+    def extract_atom(self, name):
+        return np.array(self.state[name])
+
+    def extract_box(self):
+        return BOXLO, BOXHI, 0.0, 0.0, 0.0, [1, 1, 1], 0
+
+    def close(self):
+        pass
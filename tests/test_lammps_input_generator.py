@@ -0,0 +1,232 @@
+import os
+import subprocess
+
+import pytest
+
+from workflow.core.slurm_automation import SlurmJobManager
+from workflow.lammps import lammps_input_generator as generator
+from workflow.lammps.lammps_input_generator import LammpsWorkflow, SimulationParameters
+from workflow.lammps.validate import ValidationCache
+
+
+class FakeSlurm(SlurmJobManager):
+    """Job manager that records sbatch commands instead of running them"""
+
+    def __init__(self):
+        super().__init__()
+        self.commands = []
+
+    def run_sbatch(self, cmd, working_dir):
+        self.commands.append(cmd)
+        return 0, f"Submitted batch job {len(self.commands)}", ""
+
+
+def make_params(**kwargs):
+    return SimulationParameters(temperature=300.0, monitor_properties=["totene", "dens"], **kwargs)
+
+
+def monitored(workflow):
+    """Return whether the equilibration input stops on the CONVERGED flag"""
+    return "CONVERGED" in (workflow.base_dir / "input_files" / "equilibration.in").read_text()
+
+
+def test_plain_equilibration_is_monitored(tmp_path):
+    workflow = LammpsWorkflow(base_dir=str(tmp_path), slurm_manager=FakeSlurm())
+    params = make_params()
+    workflow.create_lammps_script("equilibration", params)
+    script = (tmp_path / workflow.create_submission_script("equilibration", params)).read_text()
+
+    assert monitored(workflow)
+    assert "workflow.lammps.monitor equilibration/log.lammps" in script
+
+
+def test_replicated_equilibration_is_not_monitored(tmp_path):
+    workflow = LammpsWorkflow(base_dir=str(tmp_path), slurm_manager=FakeSlurm())
+    params = make_params(replicas=2)
+    workflow.create_lammps_script("equilibration", params)
+    script = (tmp_path / workflow.create_submission_script("equilibration", params)).read_text()
+
+    assert not monitored(workflow)
+    assert "workflow.lammps.monitor" not in script
+    assert "-log " not in script
+
+
+def test_block_loop_equilibration_is_not_monitored(tmp_path):
+    workflow = LammpsWorkflow(base_dir=str(tmp_path), slurm_manager=FakeSlurm())
+    params = make_params(equilibration_tolerance=0.001)
+    workflow.create_lammps_script("equilibration", params)
+    script = (tmp_path / workflow.create_submission_script("equilibration", params)).read_text()
+
+    assert not monitored(workflow)
+    assert "workflow.lammps.monitor" not in script
+
+
+def test_fused_equilibration_is_not_monitored(tmp_path):
+    workflow = LammpsWorkflow(base_dir=str(tmp_path), slurm_manager=FakeSlurm())
+    workflow.submit_workflow(make_params(fuse_phases=True), "fused")
+
+    assert not monitored(workflow)
+    assert "workflow.lammps.monitor" not in (tmp_path / "scripts" / "submit_fused.sh").read_text()
+
+
+def test_packed_equilibration_is_not_monitored(tmp_path):
+    workflow = LammpsWorkflow(base_dir=str(tmp_path), slurm_manager=FakeSlurm())
+    workflow.submit_packed([{"name": "a", "params": make_params()}], "pack")
+
+    assert not monitored(LammpsWorkflow(base_dir=str(tmp_path / "a"), slurm_manager=workflow.slurm_manager))
+    assert "workflow.lammps.monitor" not in (tmp_path / "scripts" / "submit_pack_pack.sh").read_text()
+
+
+def test_segment_shorter_than_restart_freq_raises(tmp_path):
+    workflow = LammpsWorkflow(base_dir=str(tmp_path), slurm_manager=FakeSlurm())
+    params = make_params(steps_per_hour=5000, time_limit="01:00:00", restart_freq=10000)
+
+    with pytest.raises(ValueError):
+        workflow.segment_ends("production", params)
+
+
+def test_segments_are_multiples_of_restart_freq(tmp_path):
+    workflow = LammpsWorkflow(base_dir=str(tmp_path), slurm_manager=FakeSlurm())
+    params = make_params(steps_per_hour=25000, time_limit="01:00:00", restart_freq=10000, production_steps=50000)
+
+    assert workflow.segment_ends("production", params) == [20000, 40000, 50000]
+
+
+def test_segments_log_completed_restarts(tmp_path):
+    workflow = LammpsWorkflow(base_dir=str(tmp_path), slurm_manager=FakeSlurm())
+    params = make_params(max_segment_steps=100000)
+    content = (tmp_path / workflow.create_lammps_script("production", params)).read_text()
+    script = (tmp_path / workflow.create_submission_script("production", params, 0)).read_text()
+
+    assert 'fix             restart_log all print 10000 "production/restart/prod.$(step-10000).restart"' in content
+    assert 'print           "production/restart/prod.$(step).restart" append production/restart/prod.restarts' in content
+    assert "ls -t production/restart/prod.*.restart" not in script
+
+
+def test_toggle_resume_skips_file_being_overwritten(tmp_path):
+    workflow = LammpsWorkflow(base_dir=str(tmp_path), slurm_manager=FakeSlurm())
+    resume = workflow._generate_resume("production", make_params(restart_mode="toggle"))
+    restart_dir = tmp_path / "production" / "restart"
+    for i, name in enumerate(["prod.last.restart", "prod.a.restart", "prod.b.restart"]):
+        (restart_dir / name).touch()
+        os.utime(restart_dir / name, (1000 + i, 1000 + i))
+    (restart_dir / "prod.restarts").write_text("production/restart/prod.last.restart\n")
+
+    # prod.b.restart is the newest and may be cut short, prod.a.restart is newer than the log entry
+    result = subprocess.run(["bash", "-c", resume + 'echo "$restart_file"'], cwd=tmp_path,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "production/restart/prod.a.restart"
+
+
+@pytest.mark.parametrize("block, every", [(50000, 10), (1234, 2), (997, 1)])
+def test_convergence_loop_averages_whole_blocks(tmp_path, block, every):
+    workflow = LammpsWorkflow(base_dir=str(tmp_path), slurm_manager=FakeSlurm())
+    params = make_params(equilibration_tolerance=0.001, equilibration_block=block)
+    content = (tmp_path / workflow.create_lammps_script("equilibration", params)).read_text()
+
+    assert f"fix             rho_avg all ave/time {every} {block // every} {block} v_rho" in content
+
+
+def test_default_manager_keeps_no_history(tmp_path):
+    assert LammpsWorkflow(base_dir=str(tmp_path)).slurm_manager.history is None
+
+    workflow = LammpsWorkflow(base_dir=str(tmp_path), history_file=str(tmp_path / "history.jsonl"))
+    assert workflow.slurm_manager.history.path == tmp_path / "history.jsonl"
+
+
+FAKE_LMP = r'''#!/usr/bin/env python3
+"""Minimal stand-in for lmp -skiprun: follows jumps, checks read files and writes restarts"""
+import re
+import sys
+
+args = sys.argv[1:]
+variables = {}
+input_file = log_file = None
+i = 0
+while i < len(args):
+    if args[i] == "-var":
+        variables[args[i + 1]] = args[i + 2]
+        i += 3
+    elif args[i] in ("-in", "-log", "-screen"):
+        input_file = args[i + 1] if args[i] == "-in" else input_file
+        log_file = args[i + 1] if args[i] == "-log" else log_file
+        i += 2
+    else:
+        i += 1
+lines = open(input_file).read().splitlines()
+labels = {line.split()[1]: n for n, line in enumerate(lines) if line.startswith("label")}
+errors = []
+k = 0
+while k < len(lines):
+    line = re.sub(r"\$\{(\w+)\}", lambda m: variables[m.group(1)], lines[k]).replace("$(step)", "0")
+    words = line.split()
+    k += 1
+    if not words:
+        continue
+    m = re.match(r'if "(\S+) != none" then "jump SELF (\w+)"', line)
+    if m and m.group(1) != "none":
+        k = labels[m.group(2)]
+    elif words[0] == "jump":
+        k = labels[words[2]]
+    elif words[0] in ("read_data", "read_restart", "include"):
+        try:
+            open(words[1].strip('"'))
+        except OSError:
+            errors.append(f"ERROR: Cannot open file {words[1]}")
+            break
+    elif words[0] == "write_restart":
+        open(words[1], "w").close()
+    elif words[0] == "print" and "append" in words:
+        with open(words[words.index("append") + 1], "a") as f:
+            f.write(line.split('"')[1] + "\n")
+with open(log_file, "w") as f:
+    f.write("\n".join(errors))
+sys.exit(1 if errors else 0)
+'''
+
+
+def fake_lmp(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "lmp").write_text(FAKE_LMP)
+    (bin_dir / "lmp").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+def make_system(tmp_path):
+    base_dir = tmp_path / "system"
+    workflow = LammpsWorkflow(base_dir=str(base_dir), slurm_manager=FakeSlurm())
+    for name in ("system.data", "system.in.settings", "system.in.charges"):
+        (base_dir / name).touch()
+    return workflow
+
+
+def test_validate_checks_segmented_restart_chain(tmp_path, monkeypatch):
+    fake_lmp(tmp_path, monkeypatch)
+    workflow = make_system(tmp_path)
+    params = make_params(max_segment_steps=100000, checkpoint_signal_lead=300)
+    cache = ValidationCache(str(tmp_path / "cache.json"))
+
+    assert workflow.validate(params, cache=cache) == {}
+    assert len(cache.load()) == 5
+
+
+def test_validate_resumes_segments(tmp_path, monkeypatch):
+    fake_lmp(tmp_path, monkeypatch)
+    workflow = make_system(tmp_path)
+    params = make_params(max_segment_steps=100000)
+    seen = []
+    original = generator.skiprun
+    monkeypatch.setattr(generator, "skiprun", lambda command, cwd, **kw: seen.append(command) or original(command, cwd, **kw))
+    workflow.validate(params, cache=ValidationCache(str(tmp_path / "cache.json")))
+
+    assert any("-var restart_file production/restart/prod.0.restart" in command for command in seen)
+
+
+def test_validate_reports_missing_files(tmp_path, monkeypatch):
+    fake_lmp(tmp_path, monkeypatch)
+    workflow = make_system(tmp_path)
+    (workflow.base_dir / "system.in.charges").unlink()
+    errors = workflow.validate(make_params(), cache=ValidationCache(str(tmp_path / "cache.json")))
+
+    assert "system.in.charges" in errors["minimization"][0]
@@ -0,0 +1,117 @@
+import json
+import os
+import numpy as np
+import pytest
+
+from workflow.lammps import library
+from stub_lammps import STATE, StubLammps
+
+# Sorted by id: atom 1 is row 1, atom 2 is row 2, atom 3 is row 0 of STATE
+UNWRAPPED = np.array([[4.0 + 10.0, 5.0 - 12.0, 6.0], [7.0, 8.0 + 24.0, 9.0 - 14.0], [1.0, 2.0, 3.0]])
+VELOCITIES = np.array([[0.1] * 3, [0.2] * 3, [0.3] * 3])
+CELL = [[0.0, 10.0], [0.0, 12.0], [0.0, 14.0]]
+
+
+def test_extract_state_unwraps_and_sorts():
+    lmp = StubLammps()
+    lmp.state = STATE
+    coord, vel, cell = library.extract_state(lmp)
+
+    np.testing.assert_allclose(coord, UNWRAPPED)
+    np.testing.assert_allclose(vel, VELOCITIES)
+    np.testing.assert_allclose(cell, CELL)
+
+
+def test_run_file_runs_in_work_dir(tmp_path):
+    (tmp_path / "in.json").write_text(json.dumps(STATE))
+    cwd = os.getcwd()
+    coord, vel, cell = library.run_file(StubLammps, "in.json", str(tmp_path), ["-screen", "none"])
+
+    assert os.getcwd() == cwd
+    np.testing.assert_allclose(coord, UNWRAPPED)
+    np.testing.assert_allclose(vel, VELOCITIES)
+    np.testing.assert_allclose(cell, CELL)
+
+
+def test_run_file_reports_worker_errors(tmp_path):
+    with pytest.raises(RuntimeError, match="FileNotFoundError"):
+        library.run_file(StubLammps, "missing.json", str(tmp_path), [])
+
+
+# LAMMPS.run_library and update_mol need RDKit and the RadonPy core modules
+try:
+    from rdkit import Chem
+    from workflow.lammps import lammps
+except ImportError:
+    Chem = lammps = None
+requires_radonpy = pytest.mark.skipif(lammps is None, reason="requires RDKit and the RadonPy core modules")
+
+
+def make_lammps(work_dir):
+    lmp = lammps.LAMMPS(work_dir=str(work_dir), check_lammps_package=False, lammps_lib=StubLammps)
+    lmp.make_input = lambda md, file_name=None: (work_dir / file_name).write_text(json.dumps(STATE))
+    return lmp
+
+
+def make_mol():
+    mol = Chem.AddHs(Chem.MolFromSmiles("O"))
+    mol.AddConformer(Chem.Conformer(mol.GetNumAtoms()), assignId=True)
+    return mol
+
+
+@requires_radonpy
+def test_run_library_updates_mol(tmp_path):
+    cwd = os.getcwd()
+    mol = make_lammps(tmp_path).run_library(md=None, mol=make_mol())
+
+    assert os.getcwd() == cwd
+    np.testing.assert_allclose(mol.GetConformer(0).GetPositions(), UNWRAPPED)
+    np.testing.assert_allclose(lammps.get_velocities(mol), VELOCITIES)
+
+
+@requires_radonpy
+def test_run_library_sets_cell(tmp_path):
+    mol = make_mol()
+    setattr(mol, "cell", lammps.utils.Cell(1.0, 0.0, 1.0, 0.0, 1.0, 0.0))
+    mol = make_lammps(tmp_path).run_library(md=None, mol=mol)
+
+    assert (mol.cell.xhi, mol.cell.yhi, mol.cell.zhi) == (10.0, 12.0, 14.0)
+
+
+@requires_radonpy
+def test_run_library_reports_errors(tmp_path):
+    lmp = make_lammps(tmp_path)
+    lmp.make_input = lambda md, file_name=None: None
+
+    assert lmp.run_library(md=None, mol=make_mol()) == 1
+
+
+@requires_radonpy
+def test_library_backend_rejects_mpi(tmp_path):
+    with pytest.raises(ValueError):
+        make_lammps(tmp_path).run(md=None, mol=make_mol(), mpi=4, backend="library")
+
+
+@requires_radonpy
+def test_velocities_survive_copies():
+    mol = make_mol()
+    for atom in mol.GetAtoms():
+        atom.SetDoubleProp("vx", 9.0)
+        atom.SetDoubleProp("vy", 9.0)
+        atom.SetDoubleProp("vz", 9.0)
+    lammps.set_velocities(mol, VELOCITIES)
+
+    assert mol.GetAtomWithIdx(1).GetDoubleProp("vy") == 0.2
+    np.testing.assert_allclose(lammps.get_velocities(Chem.Mol(mol)), VELOCITIES)
+
+
+@requires_radonpy
+def test_later_velocity_props_take_precedence():
+    mol = make_mol()
+    lammps.set_velocities(mol, VELOCITIES)
+    for atom in mol.GetAtoms():
+        atom.SetDoubleProp("vx", 5.0)
+        atom.SetDoubleProp("vy", 5.0)
+        atom.SetDoubleProp("vz", 5.0)
+
+    np.testing.assert_allclose(lammps.get_velocities(mol), np.full((3, 3), 5.0))
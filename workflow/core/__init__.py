@@ -1,2 +1,3 @@
 from .job_automation import JobManager
-from .slurm_automation import SlurmJobManager 
\ No newline at end of file
+from .slurm_automation import SlurmJobManager 
+from .slurm_accounting import JobHistory
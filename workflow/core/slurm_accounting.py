@@ -0,0 +1,200 @@
+import json
+import logging
+import math
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_HISTORY_FILE = Path.home() / ".workflow" / "slurm_history.jsonl"
+
+SACCT_FIELDS = ["JobID", "State", "Elapsed", "MaxRSS", "TotalCPU", "NCPUS", "NNodes", "NTasks", "ReqMem", "Timelimit"]
+
+def parse_slurm_time(value: str) -> Optional[float]:
+    """Convert a Slurm duration ([D-]HH:MM:SS, MM:SS.mmm, ...) to seconds"""
+    value = value.strip()
+    if not value or value in ("UNLIMITED", "Partition_Limit", "INVALID"):
+        return None
+    days = 0
+    if "-" in value:
+        day_str, value = value.split("-", 1)
+        days = int(day_str)
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return days * 86400 + seconds
+
+def format_slurm_time(seconds: float) -> str:
+    """Convert seconds to a Slurm time limit string (HH:MM:SS)"""
+    minutes = max(1, math.ceil(seconds / 60))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+def parse_memory(value: str, ncpus: int = 1) -> Optional[float]:
+    """Convert a Slurm memory value (e.g. 1234K, 16Gn, 4000Mc) to MB"""
+    value = value.strip()
+    if not value:
+        return None
+    per_cpu = value.endswith("c")
+    value = value.rstrip("nc")
+    units = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024 ** 2}
+    if value[-1] in units:
+        mb = float(value[:-1]) * units[value[-1]]
+    else:
+        mb = float(value) / 1024 ** 2  # plain bytes
+    return mb * ncpus if per_cpu else mb
+
+def format_memory(mb: float) -> str:
+    """Convert MB to a Slurm memory request string"""
+    if mb >= 10 * 1024:
+        return f"{math.ceil(mb / 1024)}G"
+    return f"{math.ceil(mb)}M"
+
+def tasks_per_node(ntasks: int, nodes: int = 1) -> int:
+    """Largest number of tasks Slurm places on one node"""
+    return math.ceil(max(1, ntasks) / max(1, nodes))
+
+def harvest_job(slurm_id: str) -> Optional[Dict]:
+    """Collect sacct accounting data (Elapsed, MaxRSS, TotalCPU, state) for a finished job
+
+    sacct MaxRSS is the peak of a single task of a step, so the memory used on a node
+    (max_rss_node) is estimated as MaxRSS times the tasks per node of that step. Both
+    it and req_mem are per node, as requested with --mem.
+    """
+    cmd = f"sacct -j {slurm_id} --format={','.join(SACCT_FIELDS)} --noheader --parsable2"
+    try:
+        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+    except Exception as e:
+        logging.error(f"Error running sacct for job {slurm_id}: {str(e)}")
+        return None
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+
+    record = None
+    max_rss = 0.0
+    max_rss_node = 0.0
+    for line in result.stdout.strip().split("\n"):
+        fields = dict(zip(SACCT_FIELDS, line.split("|")))
+        nnodes = int(fields.get("NNodes") or 1)
+        if fields["JobID"] == str(slurm_id):
+            ncpus = int(fields["NCPUS"] or 1)
+            record = {
+                "slurm_id": str(slurm_id),
+                "state": fields["State"].split()[0],
+                "elapsed": parse_slurm_time(fields["Elapsed"]),
+                "total_cpu": parse_slurm_time(fields["TotalCPU"]),
+                "ncpus": ncpus,
+                "nnodes": nnodes,
+                "req_mem": parse_memory(fields["ReqMem"], math.ceil(ncpus / nnodes)),
+                "time_limit": parse_slurm_time(fields["Timelimit"]),
+            }
+        # MaxRSS is reported on the job steps (batch, extern, srun steps), per task
+        rss = parse_memory(fields["MaxRSS"]) if fields.get("MaxRSS") else None
+        if rss:
+            max_rss = max(max_rss, rss)
+            max_rss_node = max(max_rss_node, rss * tasks_per_node(int(fields.get("NTasks") or 1), nnodes))
+
+    if record is not None:
+        record["max_rss"] = max_rss
+        record["max_rss_node"] = max_rss_node
+    return record
+
+def node_memory(record: Dict) -> Optional[float]:
+    """Peak memory per node of a record in MB
+
+    Records harvested before max_rss_node was stored scale the per-task MaxRSS by
+    the tasks per node of their features.
+    """
+    if record.get("max_rss_node"):
+        return record["max_rss_node"]
+    if not record.get("max_rss"):
+        return None
+    features = record.get("features") or {}
+    return record["max_rss"] * tasks_per_node(features.get("ntasks") or 1,
+                                               features.get("nodes") or record.get("nnodes") or 1)
+
+class JobHistory:
+    """Local store of accounting records used to right-size future submissions
+
+    Records are appended as JSON lines, so several processes can share one file.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else DEFAULT_HISTORY_FILE
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def add(self, record: Dict):
+        """Append an accounting record"""
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def records(self) -> List[Dict]:
+        """Return all stored records"""
+        if not self.path.exists():
+            return []
+        records = []
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        return records
+
+    def predict(self, features: Dict, margin: float = 1.3) -> Optional[Tuple[str, str]]:
+        """Predict (time_limit, memory) for a job from completed jobs of the same phase and ntasks
+
+        Run time is scaled linearly with steps * atoms and memory with atoms. The
+        largest scaled estimate is used and multiplied by the safety margin. Memory
+        is per node (for --mem), i.e. the per-task peak times the tasks per node.
+        """
+        times = []
+        memories = []
+        for record in self.records():
+            known = record.get("features") or {}
+            if record.get("state") != "COMPLETED":
+                continue
+            if known.get("phase") != features.get("phase") or known.get("ntasks") != features.get("ntasks"):
+                continue
+
+            atom_ratio = 1.0
+            if features.get("atoms") and known.get("atoms"):
+                atom_ratio = features["atoms"] / known["atoms"]
+            step_ratio = 1.0
+            if features.get("steps") and known.get("steps"):
+                step_ratio = features["steps"] / known["steps"]
+
+            if record.get("elapsed"):
+                times.append(record["elapsed"] * atom_ratio * step_ratio)
+            node_rss = node_memory(record)
+            if node_rss:
+                memories.append(node_rss * atom_ratio)
+
+        if not times or not memories:
+            return None
+        return format_slurm_time(max(times) * margin), format_memory(max(memories) * margin)
+
+    def efficiency_report(self, threshold: float = 0.5) -> List[Dict]:
+        """Compute CPU, memory and time efficiency of finished jobs and flag over-requested ones"""
+        report = []
+        for record in self.records():
+            elapsed = record.get("elapsed")
+            if not elapsed:
+                continue
+            entry = {
+                "name": record.get("name"),
+                "slurm_id": record.get("slurm_id"),
+                "state": record.get("state"),
+                "cpu_efficiency": (record.get("total_cpu") or 0) / (elapsed * record.get("ncpus", 1)),
+                "memory_efficiency": (node_memory(record) / record["req_mem"]
+                                      if node_memory(record) and record.get("req_mem") else None),
+                "time_efficiency": elapsed / record["time_limit"] if record.get("time_limit") else None,
+            }
+            entry["over_requested"] = [
+                key.replace("_efficiency", "") for key in ("cpu_efficiency", "memory_efficiency", "time_efficiency")
+                if record.get("state") == "COMPLETED" and entry[key] is not None and entry[key] < threshold
+            ]
+            if entry["over_requested"]:
+                logging.warning(f"Job {entry['name']} (Slurm ID: {entry['slurm_id']}) over-requested: "
+                                f"{', '.join(entry['over_requested'])}")
+            report.append(entry)
+        return report
@@ -1,13 +1,57 @@
 import subprocess
 import logging
+import threading
 import time
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Optional, Tuple
+from .slurm_accounting import JobHistory, harvest_job
+
+# sbatch errors caused by a busy controller rather than by the job itself
+TRANSIENT_SBATCH_ERRORS = (
+    "Socket timed out",
+    "Unable to contact slurm controller",
+    "Resource temporarily unavailable",
+    "Slurm temporarily unable to accept job",
+)
+
+# Exit code of a job script that checkpointed an unfinished run and should be continued
+CHECKPOINT_EXIT_CODE = 75
+
+class TokenBucket:
+    """Thread-safe token bucket limiting the rate of calls to the Slurm controller"""
+    def __init__(self, rate: float, capacity: Optional[int] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and consume it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
 
 class SlurmJobManager:
-    def __init__(self, max_concurrent_jobs: int = 50):
+    def __init__(self, max_concurrent_jobs: int = 50, max_submit_workers: int = 8,
+                 submit_rate: float = 5.0, max_submit_retries: int = 5, retry_backoff: float = 2.0,
+                 history_file: Optional[str] = None, record_history: bool = False):
         self.max_concurrent_jobs = max_concurrent_jobs
+        self.max_submit_workers = max_submit_workers
+        self.max_submit_retries = max_submit_retries
+        self.retry_backoff = retry_backoff
+        self.rate_limiter = TokenBucket(submit_rate)
         self.jobs: List[Dict] = []
         self.running_jobs: Dict[str, str] = {}  # job_name -> slurm_id
+        self.lock = threading.Lock()
+        self.history = JobHistory(history_file) if (history_file or record_history) else None
         self.setup_logging()
     
     def setup_logging(self):
@@ -34,6 +78,10 @@ class SlurmJobManager:
             cmd.append(f"--cpus-per-task={job['cpus_per_task']}")
         if 'qos' in job:
             cmd.append(f"--qos={job['qos']}")
+        if 'signal' in job:
+            cmd.append(f"--signal={job['signal']}")
+        if job.get('requeue'):
+            cmd.append("--requeue")
             
         # Handle dependencies
         if 'depends_on' in job and job['depends_on']:
@@ -54,6 +102,28 @@ class SlurmJobManager:
         
         return " ".join(cmd)
     
+    def run_sbatch(self, cmd: str, working_dir: str) -> Tuple[int, str, str]:
+        """Run an sbatch command, retrying transient controller errors with exponential backoff"""
+        for attempt in range(self.max_submit_retries + 1):
+            self.rate_limiter.acquire()
+            process = subprocess.Popen(
+                cmd,
+                shell=True,
+                cwd=working_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True
+            )
+            stdout, stderr = process.communicate()
+
+            transient = any(err in stderr for err in TRANSIENT_SBATCH_ERRORS)
+            if process.returncode == 0 or not transient or attempt == self.max_submit_retries:
+                return process.returncode, stdout, stderr
+
+            delay = self.retry_backoff * 2 ** attempt
+            logging.warning(f"Transient sbatch error, retrying in {delay:.1f}s: {stderr.strip()}")
+            time.sleep(delay)
+
     def add_job(self, name: str, script_path: str, working_dir: str = ".", **slurm_params) -> str:
         """Add a new job to the queue and return its Slurm job ID"""
         job = {
@@ -65,24 +135,16 @@ class SlurmJobManager:
         
         try:
             cmd = self.generate_sbatch_command(job)
-            process = subprocess.Popen(
-                cmd,
-                shell=True,
-                cwd=working_dir,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
+            returncode, stdout, stderr = self.run_sbatch(cmd, working_dir)
             
-            stdout, stderr = process.communicate()
-            
-            if process.returncode == 0:
+            if returncode == 0:
                 # Extract job ID from sbatch output (format: "Submitted batch job 123456")
                 job_id = stdout.strip().split()[-1]
                 job['slurm_id'] = job_id
                 job['status'] = 'submitted'
-                self.jobs.append(job)
-                self.running_jobs[name] = job_id
+                with self.lock:
+                    self.jobs.append(job)
+                    self.running_jobs[name] = job_id
                 logging.info(f"Submitted job: {name} (Slurm ID: {job_id})")
                 return job_id
             else:
@@ -92,6 +154,65 @@ class SlurmJobManager:
         except Exception as e:
             logging.error(f"Error submitting job {name}: {str(e)}")
             raise
+
+    def submit_jobs(self, jobs: List[Dict]) -> Dict[str, str]:
+        """Submit many jobs concurrently and return a mapping of job name -> Slurm job ID
+
+        Each entry takes the same keys as add_job (name, script_path, working_dir and
+        Slurm parameters). Entries of depends_on that name another job of the batch are
+        replaced by its Slurm ID, so a job is only submitted once all its parents are.
+        """
+        specs = {job['name']: dict(job) for job in jobs}
+        if len(specs) != len(jobs):
+            raise ValueError("Job names in a batch must be unique")
+
+        def batch_parents(job: Dict) -> List[str]:
+            deps = job.get('depends_on') or []
+            deps = [deps] if isinstance(deps, str) else deps
+            return [dep for dep in deps if dep in specs]
+
+        submitted: Dict[str, str] = {}
+        failed: Dict[str, str] = {}
+        pending = dict(specs)
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_submit_workers) as executor:
+            while pending or in_flight:
+                for name, job in list(pending.items()):
+                    parents = batch_parents(job)
+                    if any(p in failed for p in parents):
+                        failed[name] = "dependency failed to submit"
+                        del pending[name]
+                    elif all(p in submitted for p in parents):
+                        deps = job.get('depends_on')
+                        if deps:
+                            deps = [deps] if isinstance(deps, str) else deps
+                            job['depends_on'] = [submitted.get(dep, dep) for dep in deps]
+                        params = {k: v for k, v in job.items() if k not in ('name', 'script_path', 'working_dir')}
+                        future = executor.submit(self.add_job, name, job['script_path'],
+                                                 job.get('working_dir', '.'), **params)
+                        in_flight[future] = name
+                        del pending[name]
+
+                if not in_flight:
+                    for name in pending:
+                        failed[name] = "unresolvable dependency cycle"
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = in_flight.pop(future)
+                    try:
+                        submitted[name] = future.result()
+                    except Exception as e:
+                        failed[name] = str(e)
+
+        if failed:
+            for name, reason in failed.items():
+                logging.error(f"Job {name} was not submitted: {reason}")
+            raise Exception(f"Batch submission failed for {len(failed)} of {len(specs)} jobs")
+
+        return submitted
     
     def check_job_status(self, slurm_id: str) -> str:
         """Check the status of a Slurm job"""
@@ -100,29 +221,119 @@ class SlurmJobManager:
             result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
             if result.returncode == 0:
                 status = result.stdout.strip().split('\n')[0]
-                return status
+                return status.split()[0] if status else "UNKNOWN"  # e.g. "CANCELLED by 1234"
             return "UNKNOWN"
         except Exception:
             return "UNKNOWN"
     
+    def get_exit_code(self, slurm_id: str) -> Optional[int]:
+        """Return the exit code of a finished Slurm job"""
+        cmd = f"sacct -j {slurm_id} --format=ExitCode --noheader --parsable2"
+        try:
+            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            if result.returncode == 0 and result.stdout.strip():
+                return int(result.stdout.strip().split('\n')[0].split(':')[0])
+        except Exception:
+            pass
+        return None
+
+    def is_resumable(self, status: str, slurm_id: str) -> bool:
+        """Check whether a finished job stopped early and can be continued from its checkpoint"""
+        if status in ["TIMEOUT", "PREEMPTED"]:
+            return True
+        return status == "FAILED" and self.get_exit_code(slurm_id) == CHECKPOINT_EXIT_CODE
+
     def check_running_jobs(self):
         """Check status of running jobs and update accordingly"""
         completed_jobs = []
         
-        for job_name, slurm_id in self.running_jobs.items():
+        for job_name, slurm_id in list(self.running_jobs.items()):
             status = self.check_job_status(slurm_id)
             job = next(j for j in self.jobs if j['name'] == job_name)
             
-            if status in ["COMPLETED", "FAILED", "CANCELLED", "TIMEOUT"]:
+            if (job.get('resubmits', 0) < job.get('max_resubmits', 0)
+                    and self.is_resumable(status, slurm_id)):
+                logging.info(f"Job {job_name} (Slurm ID: {slurm_id}) stopped early ({status}), resubmitting")
+                if self.history is not None:
+                    self.record_accounting(job)
+                try:
+                    self.resubmit_job(job)
+                    continue
+                except Exception as e:
+                    logging.error(f"Error resubmitting job {job_name}: {str(e)}")
+            
+            if status in ["COMPLETED", "FAILED", "CANCELLED", "TIMEOUT", "PREEMPTED"]:
                 job['end_time'] = time.time()
                 job['status'] = "completed" if status == "COMPLETED" else "failed"
                 logging.info(f"Job {job_name} (Slurm ID: {slurm_id}) completed with status: {status}")
                 completed_jobs.append(job_name)
+                if self.history is not None:
+                    self.record_accounting(job)
         
         # Remove completed jobs from running_jobs
         for job_name in completed_jobs:
             del self.running_jobs[job_name]
     
+    def resubmit_job(self, job: Dict) -> str:
+        """Resubmit a job under the same name and point its dependents at the new Slurm ID"""
+        old_id = job['slurm_id']
+        params = {k: v for k, v in job.items() if k != 'depends_on'}  # parents have already completed
+        cmd = self.generate_sbatch_command(params)
+        returncode, stdout, stderr = self.run_sbatch(cmd, job['working_dir'])
+        if returncode != 0:
+            raise Exception(f"Job resubmission failed: {stderr}")
+
+        new_id = stdout.strip().split()[-1]
+        with self.lock:
+            job.setdefault('previous_ids', []).append(old_id)
+            job['slurm_id'] = new_id
+            job['resubmits'] = job.get('resubmits', 0) + 1
+            job['status'] = 'submitted'
+            self.running_jobs[job['name']] = new_id
+        logging.info(f"Resubmitted job: {job['name']} (Slurm ID: {old_id} -> {new_id})")
+
+        for other in self.jobs:
+            self.update_dependency(other, old_id, new_id)
+        return new_id
+
+    def update_dependency(self, job: Dict, old_id: str, new_id: str):
+        """Replace a parent Slurm ID in the dependencies of a queued job"""
+        deps = job.get('depends_on')
+        if not deps:
+            return
+        deps = [deps] if isinstance(deps, str) else list(deps)
+        if old_id not in deps:
+            return
+
+        job['depends_on'] = [new_id if dep == old_id else dep for dep in deps]
+        cmd = f"scontrol update JobId={job['slurm_id']} Dependency=afterok:{':'.join(job['depends_on'])}"
+        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        if result.returncode != 0:
+            logging.error(f"Error updating dependencies of job {job['name']}: {result.stderr}")
+
+    def record_accounting(self, job: Dict) -> Optional[Dict]:
+        """Harvest sacct data of a finished job into the history store"""
+        record = harvest_job(job['slurm_id'])
+        if record is None:
+            logging.warning(f"No accounting data for job {job['name']} (Slurm ID: {job['slurm_id']})")
+            return None
+        record['name'] = job['name']
+        record['features'] = job.get('features')
+        self.history.add(record)
+        return record
+
+    def predict_resources(self, features: Dict, margin: float = 1.3) -> Optional[Tuple[str, str]]:
+        """Predict (time_limit, memory) for a job similar to previously harvested ones"""
+        if self.history is None:
+            return None
+        return self.history.predict(features, margin=margin)
+
+    def efficiency_report(self, threshold: float = 0.5) -> List[Dict]:
+        """Report CPU, memory and time efficiency of harvested jobs, flagging over-requested ones"""
+        if self.history is None:
+            return []
+        return self.history.efficiency_report(threshold=threshold)
+
     def run_jobs(self):
         """Main method to run and manage jobs"""
         while (self.running_jobs or 
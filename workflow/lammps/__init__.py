@@ -1 +1,2 @@
-from .lammps_input_generator import LammpsWorkflow, SimulationParameters 
\ No newline at end of file
+from .lammps_input_generator import LammpsWorkflow, SimulationParameters
+from .campaign import Campaign, load_manifest
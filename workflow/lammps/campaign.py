@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, List, Optional
+import yaml
+from workflow.core.slurm_automation import SlurmJobManager
+from workflow.lammps.lammps_input_generator import LammpsWorkflow, SimulationParameters
+
+def load_manifest(manifest_file: str) -> Dict:
+    """Load a YAML campaign manifest
+
+    The manifest has an optional campaign name, defaults shared by all systems and
+    the systems themselves, either as a mapping of name to parameters or as a list
+    of entries with a "name" key:
+
+        name: pe_sweep
+        defaults:
+          ntasks: 4
+          production_steps: 1000000
+        systems:
+          pe_300: {temperature: 300}
+          pe_350: {temperature: 350}
+
+    Returns a dict with "name" and "systems" (name -> SimulationParameters).
+    """
+    with open(manifest_file) as f:
+        manifest = yaml.safe_load(f) or {}
+
+    defaults = manifest.get("defaults") or {}
+    entries = manifest.get("systems") or {}
+    if isinstance(entries, list):
+        entries = {entry["name"]: {k: v for k, v in entry.items() if k != "name"} for entry in entries}
+
+    systems = {}
+    for name, values in entries.items():
+        try:
+            systems[str(name)] = SimulationParameters(**{**defaults, **(values or {})})
+        except TypeError as e:
+            raise ValueError(f"Invalid parameters for system {name} in {manifest_file}: {str(e)}")
+
+    return {
+        "name": manifest.get("name", Path(manifest_file).stem),
+        "systems": systems,
+    }
+
+def fingerprint(params: SimulationParameters) -> str:
+    """Hash of all parameters of a system, used to detect changes between manifest versions"""
+    return hashlib.sha256(json.dumps(asdict(params), sort_keys=True).encode()).hexdigest()
+
+class Campaign:
+    """Systems declared in a YAML manifest, materialised incrementally under base_dir
+
+    Each system lives in its own sub-directory of base_dir. The fingerprint of every
+    materialised system is kept in a state file, so a sync after editing the manifest
+    only rewrites inputs of and submits new or changed systems. Input files whose
+    content did not change are not rewritten.
+    """
+    state_file_name = ".campaign_state.json"
+
+    def __init__(self, manifest_file: str, base_dir: Optional[str] = None,
+                 slurm_manager: Optional[SlurmJobManager] = None,
+                 history_file: Optional[str] = None):
+        self.manifest_file = Path(manifest_file)
+        self.base_dir = Path(base_dir) if base_dir else self.manifest_file.parent
+        self.slurm_manager = slurm_manager if slurm_manager else SlurmJobManager(max_concurrent_jobs=10,
+                                                                                 history_file=history_file)
+        self.state_file = self.base_dir / self.state_file_name
+
+    def load_state(self) -> Dict:
+        """Return the last materialised state (system name -> fingerprint and submission flag)"""
+        if not self.state_file.exists():
+            return {}
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def save_state(self, state: Dict):
+        """Atomically write the materialised state"""
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.state_file)
+
+    def diff(self, submit: bool = True) -> Dict[str, List[str]]:
+        """Compare the manifest with the last materialised state
+
+        Systems are new, changed, unchanged or removed. A system whose inputs were
+        written without submission counts as changed when submitting.
+        """
+        systems = load_manifest(str(self.manifest_file))["systems"]
+        state = self.load_state()
+        result = {"new": [], "changed": [], "unchanged": [], "removed": []}
+        for name, params in systems.items():
+            if name not in state:
+                result["new"].append(name)
+            elif state[name]["fingerprint"] != fingerprint(params) or (submit and not state[name]["submitted"]):
+                result["changed"].append(name)
+            else:
+                result["unchanged"].append(name)
+        result["removed"] = [name for name in state if name not in systems]
+        return result
+
+    def workflow(self, name: str) -> LammpsWorkflow:
+        """Return the workflow of a system"""
+        return LammpsWorkflow(base_dir=str(self.base_dir / name), slurm_manager=self.slurm_manager)
+
+    def sync(self, submit: bool = True) -> Dict[str, List[str]]:
+        """Materialise new and changed systems, and submit them if requested
+
+        Submission follows LammpsWorkflow.submit_workflow, so phases whose final
+        restart is already present are skipped; remove them to rerun a changed system.
+        Removed systems are dropped from the state but their files are kept.
+        """
+        manifest = load_manifest(str(self.manifest_file))
+        changes = self.diff(submit)
+        state = self.load_state()
+
+        for name in changes["new"] + changes["changed"]:
+            params = manifest["systems"][name]
+            workflow = self.workflow(name)
+            if submit:
+                workflow.submit_workflow(params, f"{manifest['name']}_{name}")
+            else:
+                for phase in workflow.phases:
+                    workflow.create_lammps_script(phase, params)
+            state[name] = {"fingerprint": fingerprint(params), "submitted": submit}
+            self.save_state(state)
+
+        for name in changes["removed"]:
+            logging.info(f"System {name} was removed from the manifest, keeping its files")
+            del state[name]
+        self.save_state(state)
+
+        logging.info(f"Campaign {manifest['name']}: {len(changes['new'])} new, {len(changes['changed'])} changed, "
+                     f"{len(changes['unchanged'])} unchanged, {len(changes['removed'])} removed systems")
+        return changes
@@ -0,0 +1,750 @@
+# ******************************************************************************
+# sim.lammps.dump module
+# ******************************************************************************
+
+import glob
+import gzip
+import json
+import math
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import numpy as np
+
+zstd_avail = True
+try:
+    import zstandard
+except ImportError:
+    zstd_avail = False
+
+
+def is_compressed(file_name):
+    return str(file_name).endswith(('.gz', '.zst'))
+
+
+def open_dump(file_name, mode='rt'):
+    """
+    open_dump
+
+    Open a trajectory file, decompressing gzip (.gz) and zstd (.zst) files on the fly
+
+    Args:
+        file_name: Path of trajectory file
+
+    Optional args:
+        mode: 'rt' or 'rb'
+
+    Return:
+        File object
+    """
+    file_name = str(file_name)
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, mode)
+    elif file_name.endswith('.zst'):
+        if not zstd_avail:
+            raise ImportError('zstandard is required to read %s. You can install it by "pip install zstandard"' % file_name)
+        return zstandard.open(file_name, mode)
+    return open(file_name, mode)
+
+
+def traj_file_list(traj_file):
+    """
+    traj_file_list
+
+    Expand a path, glob pattern or list of trajectory files into a list sorted by step number
+
+    Args:
+        traj_file: Path, glob pattern or list of paths
+
+    Return:
+        List of paths
+    """
+    if isinstance(traj_file, (list, tuple)):
+        files = [str(f) for f in traj_file]
+    elif glob.has_magic(str(traj_file)):
+        files = glob.glob(str(traj_file))
+    else:
+        return [str(traj_file)]
+
+    def step_key(f):
+        nums = re.findall(r'\.(\d+)\.', os.path.basename(f))
+        return (int(nums[-1]) if nums else -1, f)
+
+    return sorted(files, key=step_key)
+
+
+def find_last_frame(buf, b_size=65536):
+    """
+    find_last_frame
+
+    Locate the header of the last frame of a text dump by a reverse scan in growing blocks
+
+    Args:
+        buf: bytes-like object (e.g. mmap) of the dump file
+
+    Optional args:
+        b_size: initial block size, doubled until a frame header is found
+
+    Return:
+        Offset of the last "ITEM: TIMESTEP" line (-1 if there is none)
+    """
+    size = len(buf)
+    block = max(b_size, 64)
+    while True:
+        start = max(0, size - block)
+        pos = buf.rfind(b'ITEM: TIMESTEP', start)
+        if pos >= 0 or start == 0:
+            return pos
+        block *= 2
+
+
+def parse_dump_header(lines):
+    """
+    parse_dump_header
+
+    Parse the header lines of a dump frame (everything before "ITEM: ATOMS")
+
+    Args:
+        lines: List of header lines (str)
+
+    Return:
+        dict with timestep, natoms, box (3x2 or 3x3 array) and pbc
+    """
+    timestep = None
+    natoms = None
+    pbc = []
+    box = []
+    for i, line in enumerate(lines):
+        if line.startswith('ITEM: TIMESTEP'):
+            timestep = int(lines[i+1])
+        elif line.startswith('ITEM: NUMBER OF ATOMS'):
+            natoms = int(lines[i+1])
+        elif line.startswith('ITEM: BOX BOUNDS'):
+            pbc = line.split()[3:]
+            box = [[float(x) for x in l.split()] for l in lines[i+1:i+4]]
+
+    return {
+        'timestep': timestep,
+        'natoms': natoms,
+        'box': np.array(box, dtype=float),
+        'pbc': pbc,
+    }
+
+
+def parse_atoms(body, ncol, natoms=None, dtype=float):
+    """
+    parse_atoms
+
+    Convert the lines of an ATOMS section into an array in one numpy call
+
+    Args:
+        body: bytes of the atom lines
+        ncol: Number of columns
+
+    Optional args:
+        natoms: Number of atoms (rows beyond it are ignored)
+        dtype: dtype of the array
+
+    Return:
+        atoms x columns array in file order; non-numeric columns (e.g. element) are nan
+    """
+    tokens = body.split()
+    nrow = len(tokens) // ncol if ncol else 0
+    if natoms is not None:
+        nrow = min(nrow, natoms)
+    tokens = tokens[:nrow*ncol]
+
+    try:
+        return np.array(tokens, dtype=dtype).reshape(nrow, ncol)
+    except ValueError:
+        table = np.array(tokens).reshape(nrow, ncol)
+        data = np.full((nrow, ncol), np.nan, dtype=dtype)
+        for j in range(ncol):
+            try:
+                data[:, j] = table[:, j].astype(dtype)
+            except ValueError:
+                continue
+        return data
+
+
+def parse_dump_frame(buf, dtype=float):
+    """
+    parse_dump_frame
+
+    Parse one frame of a LAMMPS text dump, the atoms section in bulk with numpy
+
+    Args:
+        buf: bytes starting at the "ITEM: TIMESTEP" line of the frame
+
+    Optional args:
+        dtype: dtype of the atom data
+
+    Return:
+        dict with timestep, natoms, box (3x2 or 3x3 array), pbc, columns and
+        data (atoms x columns array in file order; non-numeric columns are nan),
+        or None if the frame has no atoms section
+    """
+    atoms_pos = buf.find(b'ITEM: ATOMS')
+    if atoms_pos < 0:
+        return None
+    body_pos = buf.find(b'\n', atoms_pos)
+    if body_pos < 0:
+        body_pos = len(buf)
+    body_end = buf.find(b'ITEM:', body_pos)
+    if body_end < 0:
+        body_end = len(buf)
+
+    frame = parse_dump_header(bytes(buf[:atoms_pos]).decode().split('\n'))
+    frame['columns'] = bytes(buf[atoms_pos:body_pos]).decode().split()[2:]
+    frame['data'] = parse_atoms(bytes(buf[body_pos:body_end]), len(frame['columns']), frame['natoms'], dtype)
+
+    return frame
+
+
+def select_columns(frame, columns=None, skip_absent=True, sort=True):
+    """
+    select_columns
+
+    Reduce a parsed frame to the requested columns, with atoms sorted by id
+
+    Args:
+        frame: dict returned by parse_dump_frame
+
+    Optional args:
+        columns: List of column names (all columns of the file if None)
+        skip_absent: Leave out requested columns that are not in the file,
+                     instead of filling them with zeros (boolean)
+        sort: Sort atoms by id if the file has an id column (boolean)
+
+    Return:
+        frame with columns and data replaced
+    """
+    file_columns = frame['columns']
+    data = frame['data']
+
+    if columns is None:
+        columns = list(file_columns)
+    present = [c for c in columns if c in file_columns]
+    selected = data if present == file_columns else data[:, [file_columns.index(c) for c in present]]
+    if sort and 'id' in file_columns:
+        selected = selected[np.argsort(data[:, file_columns.index('id')], kind='stable')]
+
+    if skip_absent or len(present) == len(columns):
+        frame['columns'] = present
+        frame['data'] = selected
+    else:
+        full = np.zeros((len(data), len(columns)), dtype=data.dtype)
+        for j, c in enumerate(columns):
+            if c in present:
+                full[:, j] = selected[:, present.index(c)]
+        frame['columns'] = list(columns)
+        frame['data'] = full
+
+    return frame
+
+
+def iter_dump(filename, columns=None, dtype=float, skip_absent=True, sort=True, frames=None, tmin=None, tmax=None):
+    """
+    iter_dump
+
+    Streaming reader of LAMMPS text dumps, yielding one frame at a time.
+    Only one frame is held in memory; the atoms of each frame are parsed in bulk.
+    When frames or a timestep range are selected in an uncompressed dump, the
+    sidecar index (DumpIndex) is used to seek to them directly.
+
+    Args:
+        filename: Path of trajectory file (may be gzip or zstd compressed)
+
+    Optional args:
+        columns: List of column names, e.g. ['id', 'xu', 'yu', 'zu'] (all columns if None)
+        dtype: dtype of the atom data, e.g. np.float32 to halve memory
+               (ids above 2**24 are not exact in float32)
+        skip_absent: Leave out requested columns that are not in the file (boolean)
+        sort: Sort atoms by id (boolean)
+        frames: slice or list of frame indices, applied after the timestep range
+        tmin, tmax: Timestep range (inclusive)
+
+    Return:
+        Generator of dicts with timestep, natoms, box, pbc, columns and data (atoms x columns array)
+    """
+    selected = frames is not None or tmin is not None or tmax is not None
+    if selected and not is_compressed(filename):
+        index = DumpIndex(filename)
+        index.update()
+        ks = index.select(tmin, tmax)
+        if isinstance(frames, slice):
+            ks = ks[frames]
+        elif frames is not None:
+            ks = [ks[k] for k in frames]
+        yield from index.iter_frames(ks, columns, dtype, skip_absent, sort)
+        return
+
+    if isinstance(frames, slice):
+        if any(v is not None and v < 0 for v in (frames.start, frames.stop, frames.step)):
+            raise ValueError('Negative frame indices need random access, which compressed dumps do not support')
+        wanted = lambda k: k >= (frames.start or 0) and (frames.stop is None or k < frames.stop) \
+            and (k - (frames.start or 0)) % (frames.step or 1) == 0
+    elif frames is not None:
+        frames = set(frames)
+        if any(k < 0 for k in frames):
+            raise ValueError('Negative frame indices need random access, which compressed dumps do not support')
+        wanted = lambda k: k in frames
+    else:
+        wanted = lambda k: True
+
+    k = 0
+    with open_dump(filename, 'rb') as fh:
+        while True:
+            header = []
+            for line in fh:
+                if line.startswith(b'ITEM: ATOMS'):
+                    break
+                header.append(line.decode())
+            else:
+                return
+
+            frame = parse_dump_header([l.rstrip('\r\n') for l in header])
+            frame['columns'] = line.decode().split()[2:]
+            body = b''.join(islice(fh, frame['natoms']))
+            if (tmin is not None and frame['timestep'] < tmin) or (tmax is not None and frame['timestep'] > tmax):
+                continue
+            if wanted(k):
+                frame['data'] = parse_atoms(body, len(frame['columns']), frame['natoms'], dtype)
+                yield select_columns(frame, columns, skip_absent, sort)
+            k += 1
+
+
+def skip_lines(buf, start, n):
+    """
+    skip_lines
+
+    Offset just after the n-th line starting at start, or -1 if fewer complete lines follow.
+    Where the next "ITEM:" header follows directly, the lines are counted in one call.
+    """
+    if n == 0:
+        return start
+    nxt = buf.find(b'ITEM:', start)
+    if nxt >= 0 and buf[start:nxt].count(b'\n') == n:
+        return nxt
+
+    pos = start
+    for _ in range(n):
+        pos = buf.find(b'\n', pos)
+        if pos < 0:
+            return -1
+        pos += 1
+    return pos
+
+
+class DumpIndex():
+    """
+    DumpIndex
+
+    Byte offset, timestep, number of atoms and box of every frame of an uncompressed
+    text dump, kept in a sidecar file (<dump>.idx). The file is indexed in one pass
+    and later extended from the last indexed frame as the dump grows, so any frame
+    can be read with one seek.
+    """
+    suffix = '.idx'
+
+    def __init__(self, filename, index_file=None):
+        if is_compressed(filename):
+            raise ValueError('Compressed dump %s can not be indexed for random access' % filename)
+        self.filename = str(filename)
+        self.index_file = str(index_file) if index_file else self.filename + self.suffix
+        self.size = 0
+        self.frames = []
+        self.load()
+
+
+    def load(self):
+        """
+        DumpIndex.load
+
+        Read the sidecar file, discarding it if the dump was replaced or rewritten
+        """
+        if not os.path.isfile(self.index_file):
+            return
+        try:
+            with open(self.index_file) as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return
+        if not os.path.isfile(self.filename):
+            return
+        if data.get('inode') not in (None, os.stat(self.filename).st_ino):
+            return
+        self.size = data['size']
+        self.frames = data['frames']
+        if not self.is_valid():
+            self.size = 0
+            self.frames = []
+
+
+    def is_valid(self):
+        """
+        DumpIndex.is_valid
+
+        Check that the dump still holds the indexed frames: it must not be smaller than the indexed part,
+        and the headers at the first and last indexed offsets must give the indexed timestep and number of atoms.
+        A dump rewritten in place (same inode, same or larger size) fails this check.
+
+        Return:
+            boolean
+        """
+        if not self.frames:
+            return True
+        if os.path.getsize(self.filename) < self.size:
+            return False
+        with open(self.filename, 'rb') as fh:
+            for offset, end, timestep, natoms, _ in (self.frames[0], self.frames[-1]):
+                fh.seek(offset)
+                head = fh.read(min(end - offset, 4096))
+                atoms_pos = head.find(b'ITEM: ATOMS')
+                if not head.startswith(b'ITEM: TIMESTEP') or atoms_pos < 0:
+                    return False
+                try:
+                    header = parse_dump_header(head[:atoms_pos].decode().split('\n'))
+                except (UnicodeDecodeError, ValueError, IndexError):
+                    return False
+                if header['timestep'] != timestep or header['natoms'] != natoms:
+                    return False
+            fh.seek(self.size - 1)
+            if fh.read(1) != b'\n':
+                return False
+        return True
+
+
+    def save(self):
+        tmp_file = '%s.%i.tmp' % (self.index_file, os.getpid())
+        with open(tmp_file, 'w') as fh:
+            json.dump({'size': self.size, 'inode': os.stat(self.filename).st_ino, 'frames': self.frames}, fh)
+        os.replace(tmp_file, self.index_file)
+
+
+    def update(self):
+        """
+        DumpIndex.update
+
+        Index frames written since the last update and save the sidecar file.
+        A frame still being written is left for the next update.
+
+        Return:
+            Number of frames added (int)
+        """
+        size = os.path.getsize(self.filename)
+        if not self.is_valid():
+            self.size = 0
+            self.frames = []
+        if size == self.size:
+            return 0
+
+        added = 0
+        with open(self.filename, 'rb') as fh:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = mm.find(b'ITEM: TIMESTEP', self.size)
+                while pos >= 0:
+                    atoms_pos = mm.find(b'ITEM: ATOMS', pos)
+                    body_pos = mm.find(b'\n', atoms_pos) if atoms_pos >= 0 else -1
+                    if body_pos < 0:
+                        break
+                    header = parse_dump_header(mm[pos:atoms_pos].decode().split('\n'))
+                    # The frame ends after its natoms-th atom line; bytes after it (e.g. a
+                    # partly written next header) are left for the next update
+                    end = skip_lines(mm, body_pos + 1, header['natoms'])
+                    if end < 0:
+                        break
+                    self.frames.append([pos, end, header['timestep'], header['natoms'], header['box'].tolist()])
+                    self.size = end
+                    added += 1
+                    pos = mm.find(b'ITEM: TIMESTEP', end) if end < size else -1
+
+        if added:
+            self.save()
+        return added
+
+
+    def __len__(self):
+        return len(self.frames)
+
+
+    @property
+    def timesteps(self):
+        return np.array([f[2] for f in self.frames], dtype=np.int64)
+
+
+    def select(self, tmin=None, tmax=None, step=1):
+        """
+        DumpIndex.select
+
+        Indices of frames with tmin <= timestep <= tmax
+
+        Optional args:
+            tmin, tmax: Timestep range (None for open ends)
+            step: Take every step-th frame of the range (int)
+
+        Return:
+            List of frame indices
+        """
+        timesteps = self.timesteps
+        lo = 0 if tmin is None else int(np.searchsorted(timesteps, tmin, side='left'))
+        hi = len(timesteps) if tmax is None else int(np.searchsorted(timesteps, tmax, side='right'))
+        return list(range(lo, hi, step))
+
+
+    def read_bytes(self, k):
+        offset, end = self.frames[k][:2]
+        with open(self.filename, 'rb') as fh:
+            fh.seek(offset)
+            return fh.read(end - offset)
+
+
+    def frame(self, k, columns=None, dtype=float, skip_absent=True, sort=True):
+        """
+        DumpIndex.frame
+
+        Read frame k (negative k counts from the end) with one seek
+
+        Return:
+            dict as yielded by iter_dump
+        """
+        frame = parse_dump_frame(self.read_bytes(k), dtype)
+        return select_columns(frame, columns, skip_absent, sort)
+
+
+    def iter_frames(self, frames=None, columns=None, dtype=float, skip_absent=True, sort=True):
+        """
+        DumpIndex.iter_frames
+
+        Read selected frames, e.g. frames=slice(-10, None) or frames=range(0, len(index), 10)
+
+        Return:
+            Generator of frame dicts
+        """
+        if frames is None:
+            frames = range(len(self.frames))
+        elif isinstance(frames, slice):
+            frames = range(len(self.frames))[frames]
+        with open(self.filename, 'rb') as fh:
+            for k in frames:
+                offset, end = self.frames[k][:2]
+                fh.seek(offset)
+                frame = parse_dump_frame(fh.read(end - offset), dtype)
+                yield select_columns(frame, columns, skip_absent, sort)
+
+
+def dump_columns(filename):
+    """
+    dump_columns
+
+    Column names of the ATOMS section of the first frame of a dump
+    """
+    with open_dump(filename, 'rb') as fh:
+        for line in fh:
+            if line.startswith(b'ITEM: ATOMS'):
+                return line.decode().split()[2:]
+    return []
+
+
+def scan_dump(filename):
+    """
+    scan_dump
+
+    Frame table of a dump in the form of DumpIndex.frames. Uncompressed files are
+    indexed; compressed files are scanned once without parsing atoms and have no offsets.
+    """
+    if not is_compressed(filename):
+        index = DumpIndex(filename)
+        index.update()
+        return index.frames
+
+    frames = []
+    with open_dump(filename, 'rb') as fh:
+        while True:
+            header = []
+            for line in fh:
+                if line.startswith(b'ITEM: ATOMS'):
+                    break
+                header.append(line.decode().rstrip('\r\n'))
+            else:
+                return frames
+            info = parse_dump_header(header)
+            for _ in islice(fh, info['natoms']):
+                pass
+            frames.append([None, None, info['timestep'], info['natoms'], info['box'].tolist()])
+
+
+def _attach(target):
+    kind, name, shape, dtype = target
+    if kind == 'memmap':
+        return None, np.load(name, mmap_mode='r+')
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _load_frames(filename, tasks, target, columns):
+    # Worker of load_dump_parallel: parse frames and write them into the shared array
+    # tasks are (position in the output, frame index in the file, offset, end)
+    shm, out = _attach(target)
+    try:
+        if tasks[0][2] is not None:
+            with open(filename, 'rb') as fh:
+                for k, _, offset, end in tasks:
+                    fh.seek(offset)
+                    frame = select_columns(parse_dump_frame(fh.read(end - offset), out.dtype), columns, False)
+                    out[k] = frame['data']
+        else:
+            frames = iter_dump(filename, columns, out.dtype, skip_absent=False, frames=[i for _, i, _, _ in tasks])
+            for (k, _, _, _), frame in zip(tasks, frames):
+                out[k] = frame['data']
+        if isinstance(out, np.memmap):
+            out.flush()
+    finally:
+        del out
+        if shm is not None:
+            shm.close()
+    return len(tasks)
+
+
+class SharedTraj():
+    """
+    SharedTraj
+
+    Trajectory loaded by load_dump_parallel. data is a (frames, atoms, columns) view of
+    shared memory (or of a memmap file) filled by the worker processes, without copies.
+    Call close() when done; it releases the shared memory block.
+    """
+    def __init__(self, data, columns, timesteps, boxes, shm=None):
+        self.data = data
+        self.columns = columns
+        self.timesteps = timesteps
+        self.boxes = boxes
+        self.shm = shm
+
+
+    def column(self, name):
+        """
+        SharedTraj.column
+
+        (frames, atoms) view of one column
+        """
+        return self.data[:, :, self.columns.index(name)]
+
+
+    def close(self):
+        if self.shm is not None:
+            self.data = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_dump_parallel(traj_file, columns=None, dtype=float, nproc=None, memmap_file=None,
+                       tmin=None, tmax=None, step=1, chunk_frames=None):
+    """
+    load_dump_parallel
+
+    Parse text dumps in a process pool into one (frames, atoms, columns) array.
+    Frames are split into ranges; each worker parses its range and writes it straight
+    into shared memory (or a memmap file), so no frame data is pickled between processes.
+    Uncompressed files are split at frame offsets from the sidecar index (DumpIndex);
+    compressed files are handled one file per worker.
+
+    Args:
+        traj_file: Path, glob pattern (e.g. 'prod.*.lammpstrj') or list of dump files
+
+    Optional args:
+        columns: List of column names (all columns of the first frame if None).
+                 Columns missing from a file are filled with zeros.
+        dtype: dtype of the array, e.g. np.float32
+        nproc: Number of worker processes (all cores if None)
+        memmap_file: Write to this .npy file (opened as memmap) instead of shared memory
+        tmin, tmax: Timestep range (inclusive)
+        step: Take every step-th frame
+        chunk_frames: Frames per task (split evenly over 4 tasks per worker if None)
+
+    Return:
+        SharedTraj (atoms are sorted by id in every frame)
+    """
+    try:
+        from multiprocessing import resource_tracker, shared_memory
+    except ImportError:
+        raise ImportError('load_dump_parallel requires multiprocessing.shared_memory (Python 3.8 or later)')
+
+    files = traj_file_list(traj_file)
+    nproc = nproc if nproc else os.cpu_count()
+    if columns is None:
+        columns = dump_columns(files[0])
+    dtype = np.dtype(dtype)
+
+    # Workers started after the resource tracker share it, so attaching to the
+    # shared memory block in a worker does not hand it to a tracker of its own
+    resource_tracker.ensure_running()
+    with ProcessPoolExecutor(max_workers=nproc) as pool:
+        tables = list(pool.map(scan_dump, files))
+
+        # (file, frame index in the file, frame row) of all selected frames
+        selected = []
+        for name, table in zip(files, tables):
+            for i, row in enumerate(table):
+                if (tmin is None or row[2] >= tmin) and (tmax is None or row[2] <= tmax):
+                    selected.append((name, i, row))
+        selected = selected[::step]
+        if len(selected) == 0:
+            raise ValueError('No frames found in %s' % traj_file)
+
+        natoms = set(row[3] for _, _, row in selected)
+        if len(natoms) > 1:
+            raise ValueError('Number of atoms changes between frames (%s)' % ', '.join(str(n) for n in sorted(natoms)))
+        shape = (len(selected), natoms.pop(), len(columns))
+
+        shm = None
+        if memmap_file:
+            data = np.lib.format.open_memmap(memmap_file, mode='w+', dtype=dtype, shape=shape)
+            target = ('memmap', str(memmap_file), shape, dtype.str)
+        else:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+            data = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            target = ('shm', shm.name, shape, dtype.str)
+
+        if chunk_frames is None:
+            chunk_frames = max(1, math.ceil(len(selected) / (4 * nproc)))
+        tasks = {}
+        for k, (name, i, row) in enumerate(selected):
+            tasks.setdefault(name, []).append((k, i, row[0], row[1]))
+        futures = []
+        for name, file_tasks in tasks.items():
+            if is_compressed(name):
+                futures.append(pool.submit(_load_frames, name, file_tasks, target, columns))
+                continue
+            for j in range(0, len(file_tasks), chunk_frames):
+                futures.append(pool.submit(_load_frames, name, file_tasks[j:j+chunk_frames], target, columns))
+
+        try:
+            for future in futures:
+                future.result()
+        except Exception:
+            # The view of the shared buffer is released first, otherwise closing it raises BufferError
+            del data
+            if shm is not None:
+                try:
+                    shm.close()
+                    shm.unlink()
+                except (BufferError, OSError):
+                    pass
+            raise
+
+    timesteps = np.array([row[2] for _, _, row in selected], dtype=np.int64)
+    boxes = [np.array(row[4]) for _, _, row in selected]
+    return SharedTraj(data, list(columns), timesteps, boxes, shm)
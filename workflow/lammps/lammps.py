@@ -8,7 +8,13 @@
 
 import subprocess
 import os
+import re
+import shutil
+import json
 import math
+import mmap
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from scipy import stats
 import pandas as pd
@@ -17,6 +23,10 @@ from rdkit import Chem
 from rdkit import Geometry as Geom
 from ..core import calc, poly, const, utils
 from ..ff import ff_class
+from .validate import ValidationCache, dry_run
+from .dump import zstd_avail, is_compressed, open_dump, traj_file_list, find_last_frame, parse_dump_frame, iter_dump, DumpIndex
+from .store import TrajStore, is_store
+from .library import extract_state, run_file
 
 __version__ = '0.2.9'
 
@@ -26,7 +36,139 @@ try:
 except ImportError:
     mdtraj_avail = False
 
+lammps_lib_avail = True
+try:
+    from lammps import lammps as lammps_lib
+except ImportError:
+    lammps_lib = None
+    lammps_lib_avail = False
+
 check_package = {}
+autotune_cache = {}
+
+
+class LAMMPSProcess():
+    """
+    LAMMPSProcess
+
+    Handle of a LAMMPS run started by LAMMPS.exec
+    """
+
+    def __init__(self, cmd, popen, output_file, spool_file=None):
+        self.cmd = cmd
+        self.popen = popen
+        self.output_file = output_file
+        self.spool_file = spool_file
+        self.result = None
+
+
+    def poll(self):
+        """
+        LAMMPSProcess.poll
+
+        Return:
+            Return code, or None while LAMMPS is running
+        """
+        return self.popen.poll()
+
+
+    def done(self):
+        return self.popen.poll() is not None
+
+
+    def kill(self):
+        self.popen.kill()
+
+
+    def wait(self, timeout=None):
+        """
+        LAMMPSProcess.wait
+
+        Wait for LAMMPS to finish and append the spooled screen output to the output file
+
+        Optional args:
+            timeout: Timeout in seconds (float)
+
+        Return:
+            subprocess.CompletedProcess
+        """
+        if self.result is not None:
+            return self.result
+
+        self.popen.wait(timeout=timeout)
+        with open(self.output_file, 'a') as fh:
+            fh.write(self.cmd+'\n')
+            if self.spool_file is not None and os.path.isfile(self.spool_file):
+                with open(self.spool_file, 'r') as spool:
+                    shutil.copyfileobj(spool, fh)
+                os.remove(self.spool_file)
+                fh.write('\n')
+            fh.write('LAMMPS returncode = %s \n' % (str(self.popen.returncode)))
+
+        # Screen output is on disk only, so memory use does not grow with the run length
+        self.result = subprocess.CompletedProcess(self.cmd, self.popen.returncode, None, None)
+        return self.result
+
+
+class LAMMPSPool():
+    """
+    LAMMPSPool
+
+    Run many LAMMPS.run (or any LAMMPS method) calls concurrently from one process.
+    Each call should use its own LAMMPS instance with a separate work_dir (or idx),
+    so input, data and log files do not collide.
+
+    Example:
+        with LAMMPSPool(max_workers=4) as pool:
+            futures = [pool.submit(LAMMPS(work_dir=d), md, mol=m, omp=2) for d, m in zip(dirs, mols)]
+            mols = [f.result() for f in futures]
+    """
+
+    def __init__(self, max_workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+
+    def submit(self, lmp, *args, method='run', **kwargs):
+        """
+        LAMMPSPool.submit
+
+        Args:
+            lmp: LAMMPS instance
+
+        Optional args:
+            method: Name of the LAMMPS method to call (str)
+            args, kwargs: Arguments of the method
+
+        Return:
+            concurrent.futures.Future
+        """
+        return self.executor.submit(getattr(lmp, method), *args, **kwargs)
+
+
+    def map(self, tasks):
+        """
+        LAMMPSPool.map
+
+        Args:
+            tasks: List of (LAMMPS instance, args (tuple), kwargs (dict)) for LAMMPS.run
+
+        Return:
+            List of results in the order of tasks
+        """
+        futures = [self.submit(lmp, *args, **kwargs) for lmp, args, kwargs in tasks]
+        return [f.result() for f in futures]
+
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
 
 
 class LAMMPS():
@@ -38,6 +180,10 @@ class LAMMPS():
         self.dat_file = kwargs.get('dat_file', 'radon_md_lmp.data' if self.idx is None else 'radon_md_lmp_%i.data' % self.idx)
         self.input_file = kwargs.get('input_file', 'radon_lmp.in' if self.idx is None else 'radon_lmp_%i.in' % self.idx)
         self.output_file = kwargs.get('output_file', 'log.lammps')
+        self.autotune_file = kwargs.get('autotune_file', os.path.join(os.path.expanduser('~'), '.workflow', 'lammps_autotune.json'))
+        self.probe_file = kwargs.get('probe_file', os.path.join(os.path.expanduser('~'), '.workflow', 'lammps_probe.json'))
+        self.lammps_lib = kwargs.get('lammps_lib', lammps_lib)
+        self.validation_file = kwargs.get('validation_file', os.path.join(os.path.expanduser('~'), '.workflow', 'lammps_validation.json'))
 
         self.package = {
             'omp': False,
@@ -62,7 +208,9 @@ class LAMMPS():
         return 'LAMMPS'
 
 
-    def exec(self, input_file=None, output_file=None, omp=0, mpi=0, gpu=0, return_cmd=False, intel='off', opt='off'):
+    def exec(self, input_file=None, output_file=None, omp=0, mpi=0, gpu=0, return_cmd=False, intel='off', opt='off',
+             autotune=False, partition=0, replica_vars=None, replica_dir='replica', env=None, wait=True,
+             screen_file=None, suppress_screen=False):
         """
         LAMMPS.exec
 
@@ -74,14 +222,31 @@ class LAMMPS():
             omp: Number of openMP thread (int)
             mpi: Number of MPI process (int)
             gpu: Num ber of GPU (int)
+            autotune: Use the fastest parallel configuration found by LAMMPS.autotune (boolean)
+            partition: Number of replicas run concurrently by LAMMPS -partition, each with mpi processes (int)
+            replica_vars: Replica-specific values, defined as world-style variables in the input
+                          {name: [value of replica 0, value of replica 1, ...]} (dict)
+            replica_dir: Directory of per-replica log files log.lammps.N (str)
+            env: Additional environment variables of this run only (dict)
+            wait: Wait for LAMMPS to finish; otherwise return a LAMMPSProcess handle at once (boolean)
+            screen_file: Path, file object or file descriptor that screen output (stdout and stderr)
+                         is streamed to while LAMMPS runs. By default it is streamed to
+                         output_file.screen and appended to output_file when LAMMPS has finished (str)
+            suppress_screen: Run LAMMPS with -screen none, so thermo output is not written
+                             to the screen in addition to the log file (boolean)
 
         Return:
-            Return args of subprocess.run()
+            subprocess.CompletedProcess, or LAMMPSProcess if wait is False
         """
 
         input_file = input_file if input_file else self.input_file
         output_file = output_file if output_file else self.output_file
 
+        if autotune and type(input_file) is not list:
+            best = self.autotune(input_file=input_file, gpu=gpu)
+            if best:
+                omp, mpi, gpu, intel, opt = best['omp'], best['mpi'], best['gpu'], best['intel'], best['opt']
+
         if omp != 0 and not self.package['omp']:
             omp = 0
             utils.radon_print('OPENMP package is not available. Parallel number of OPENMP is changed to zero.', level=2)
@@ -118,10 +283,13 @@ class LAMMPS():
         elif mpi < 0:
             mpi_cmd = const.mpi_cmd
 
+        # Per-run environment, so concurrent runs do not interfere through os.environ
+        run_env = os.environ.copy()
+        run_env.update(env if env else {})
         if omp == 0:
-            os.environ['OMP_NUM_THREADS'] = str(1)
+            run_env['OMP_NUM_THREADS'] = str(1)
         else:
-            os.environ['OMP_NUM_THREADS'] = str(omp)
+            run_env['OMP_NUM_THREADS'] = str(omp)
 
         if gpu > 0 and omp > 0:
             acc_str = '-sf gpu -pk gpu %i omp %i' % (gpu, omp)
@@ -142,6 +310,18 @@ class LAMMPS():
             else:
                 acc_str = ''
 
+        if partition > 0:
+            if type(input_file) is list:
+                utils.radon_print('Multi-replica run can not use a list of input files.', level=3)
+            input_file = self.make_replica_input(input_file, partition, replica_vars)
+            mpi = max(mpi, 1)
+            mpi_cmd = const.mpi_cmd % (partition * mpi)
+            os.makedirs(os.path.join(self.work_dir, replica_dir), exist_ok=True)
+            acc_str = '-partition %ix%i -plog %s -pscreen none %s' % (partition, mpi, os.path.join(replica_dir, 'log.lammps'), acc_str)
+
+        if suppress_screen:
+            acc_str = '-screen none %s' % acc_str
+
         if type(input_file) is list:
             for i, infile in enumerate(input_file):
                 if i == 0:
@@ -156,22 +336,119 @@ class LAMMPS():
         if return_cmd:
             return cmd
 
-        cwd = os.getcwd()
-        os.chdir(self.work_dir)
-        cp = subprocess.run([cmd], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='UTF-8')
-        with open(output_file, 'a') as fh:
-            fh.write(cmd+'\n')
-            fh.write(cp.stdout+'\n')
-            fh.write(cp.stderr+'\n')
-            fh.write('LAMMPS returncode = %s \n' % (str(cp.returncode)))
+        spool_file = None
+        if screen_file is None:
+            spool_file = os.path.join(self.work_dir, '%s.screen' % output_file)
+            screen = open(spool_file, 'w')
+        elif type(screen_file) is int or hasattr(screen_file, 'fileno'):
+            screen = screen_file
+        else:
+            screen = open(os.path.join(self.work_dir, screen_file), 'a')
+
+        try:
+            popen = subprocess.Popen([cmd], shell=True, cwd=self.work_dir, env=run_env,
+                                     stdout=screen, stderr=subprocess.STDOUT)
+        finally:
+            if screen is not screen_file:
+                screen.close()
+        proc = LAMMPSProcess(cmd, popen, os.path.join(self.work_dir, output_file), spool_file)
+        if not wait:
+            return proc
+
+        return proc.wait()
+
+
+    def validate(self, md=None, input_file=None, cache=True):
+        """
+        LAMMPS.validate
+
+        Dry run of an input with -skiprun (setup only, no dynamics) to find errors
+        before a long run or a job submission. The run takes place in a temporary
+        copy of the input and the files it reads. Results are cached by input hash.
+
+        Optional args:
+            md: MD object, whose input is written to input_file first
+            input_file: Input file path (str)
+            cache: Use and update the validation cache (boolean)
+
+        Return:
+            List of error messages (empty if the input is valid)
+        """
+
+        input_file = input_file if input_file else self.input_file
+        if md is not None:
+            self.make_input(md, file_name=input_file)
+
+        errors = dry_run(input_file, work_dir=self.work_dir, lmp=self.solver_path,
+                         cache=ValidationCache(self.validation_file) if cache else None)
+        for e in errors:
+            utils.radon_print('Dry run of %s: %s' % (input_file, e), level=2)
+
+        return errors
+
 
-        os.chdir(cwd)
+    def make_replica_input(self, input_file, partition, replica_vars=None):
+        """
+        LAMMPS.make_replica_input
 
-        return cp
+        Write an input file defining replica-specific world-style variables and including input_file.
+        The variable replica holds the replica index.
+
+        Args:
+            input_file: Input file path (str)
+            partition: Number of replicas (int)
+
+        Optional args:
+            replica_vars: {name: [value of replica 0, value of replica 1, ...]} (dict)
+
+        Return:
+            Path of the replica input file (str)
+        """
+        replica_vars = replica_vars if replica_vars else {}
+        indata = ['variable replica world %s' % ' '.join([str(i) for i in range(partition)])]
+        for name, values in replica_vars.items():
+            if len(values) != partition:
+                utils.radon_print('Number of values of %s (%i) does not match the number of replicas (%i).'
+                    % (name, len(values), partition), level=3)
+            indata.append('variable %s world %s' % (name, ' '.join([str(v) for v in values])))
+        indata.append('include %s' % input_file)
+
+        replica_file = 'replica_%s' % os.path.basename(input_file)
+        with open(os.path.join(self.work_dir, replica_file), 'w') as fh:
+            fh.write('\n'.join(indata) + '\n')
+
+        return replica_file
 
 
     def run(self, md, mol=None, confId=0, input_file=None, output_file=None, last_data=None, last_str=None,
-            omp=0, mpi=0, gpu=0, intel='off', opt='off'):
+            omp=0, mpi=0, gpu=0, intel='off', opt='off', autotune=False, backend='subprocess'):
+        """
+        LAMMPS.run
+
+        Run LAMMPS with the input of md and update the coordinates, velocities and cell of mol
+
+        Args:
+            md: MD object
+
+        Optional args:
+            mol: RDKit Mol object
+            confId: Target conformer ID (int)
+            omp, mpi, gpu, intel, opt, autotune: See LAMMPS.exec
+            backend: 'subprocess' runs the lmp executable and reads the final structure from the dump file,
+                     'library' runs LAMMPS through its Python module in a worker process;
+                     it is serial, so mpi, intel, opt and autotune are not supported (str)
+
+        Return:
+            RDKit Mol object, or return code of LAMMPS on error
+        """
+
+        if backend == 'library':
+            unsupported = [name for name, value, default in (('mpi', mpi, 0), ('intel', intel, 'off'), ('opt', opt, 'off'),
+                                                             ('autotune', autotune, False)) if value != default]
+            if unsupported:
+                raise ValueError('%s can not be used with backend=\'library\'' % ', '.join(unsupported))
+            return self.run_library(md, mol=mol, confId=confId, input_file=input_file, output_file=output_file,
+                                    omp=omp, gpu=gpu)
 
         input_file = input_file if input_file else self.input_file
         output_file = output_file if output_file else self.output_file
@@ -183,7 +460,8 @@ class LAMMPS():
         if not os.path.isfile(os.path.join(self.work_dir, input_file)):
             utils.radon_print('Cannot write LAMMPS input file.', level=2)
 
-        cp = self.exec(input_file=input_file, output_file=output_file, omp=omp, mpi=mpi, gpu=gpu, intel=intel, opt=opt)
+        cp = self.exec(input_file=input_file, output_file=output_file, omp=omp, mpi=mpi, gpu=gpu, intel=intel, opt=opt,
+                       autotune=autotune)
 
         if cp.returncode != 0 and (
                     (last_data is not None and not os.path.exists(os.path.join(self.work_dir, last_data)))
@@ -198,114 +476,503 @@ class LAMMPS():
 
         if isinstance(mol, Chem.Mol):
             uwstr, wstr, cell, vel, _ = self.read_traj_simple(os.path.join(self.work_dir, last_str))
+            mol = self.update_mol(mol, uwstr, vel, cell, confId=confId)
+
+        return mol
+
+
+    def update_mol(self, mol, coord, vel, cell, confId=0):
+        """
+        LAMMPS.update_mol
+
+        Set coordinates, velocities and cell of a LAMMPS run on mol
+        Positions are set in one call and velocities are stored as one array (see set_velocities)
+
+        Args:
+            mol: RDKit Mol object
+            coord: Unwrapped atomic coordinates (numpy.ndarray)
+            vel: Atomic velocities (numpy.ndarray)
+            cell: Cell lengths [[xlo, xhi], [ylo, yhi], [zlo, zhi]] (numpy.ndarray)
+
+        Optional args:
+            confId: Target conformer ID (int)
+
+        Return:
+            RDKit Mol object
+        """
 
-            for i in range(mol.GetNumAtoms()):
-                mol.GetConformer(confId).SetAtomPosition(i, Geom.Point3D(uwstr[i, 0], uwstr[i, 1], uwstr[i, 2]))
-                mol.GetAtomWithIdx(i).SetDoubleProp('vx', vel[i, 0])
-                mol.GetAtomWithIdx(i).SetDoubleProp('vy', vel[i, 1])
-                mol.GetAtomWithIdx(i).SetDoubleProp('vz', vel[i, 2])
+        set_positions(mol.GetConformer(confId), coord)
+        set_velocities(mol, vel)
 
-            if hasattr(mol, 'cell'):
-                setattr(mol, 'cell', utils.Cell(cell[0, 1], cell[0, 0], cell[1, 1], cell[1, 0], cell[2, 1], cell[2, 0]))
-                mol = calc.mol_trans_in_cell(mol, confId=confId)
+        if hasattr(mol, 'cell'):
+            setattr(mol, 'cell', utils.Cell(cell[0, 1], cell[0, 0], cell[1, 1], cell[1, 0], cell[2, 1], cell[2, 0]))
+            mol = calc.mol_trans_in_cell(mol, confId=confId)
 
         return mol
 
 
-    def check_package(self):
-        check_omp = False
-        check_intel = False
-        check_opt = False
-        check_gpu = False
+    def run_library(self, md, mol=None, confId=0, input_file=None, output_file=None, omp=0, gpu=0):
+        """
+        LAMMPS.run_library
+
+        Run LAMMPS through the LAMMPS Python module (serial, one MPI rank) and take the
+        final coordinates, velocities and cell directly from its memory instead of
+        writing and parsing a dump file. The library runs in a worker process started
+        in work_dir (see library.run_file), so the working directory of this process
+        is never changed.
+        The library constructor can be replaced by the lammps_lib argument of LAMMPS;
+        it must be picklable (e.g. a module-level class).
+
+        Args:
+            md: MD object
+
+        Optional args:
+            mol: RDKit Mol object
+            confId: Target conformer ID (int)
+            input_file: Input file path (str)
+            output_file: Log file (str)
+            omp: Number of openMP thread (int)
+            gpu: Number of GPU (int)
+
+        Return:
+            RDKit Mol object, or 1 on error
+        """
+
+        if self.lammps_lib is None:
+            utils.radon_print('LAMMPS Python module is not available. You can install it by "conda install -c conda-forge lammps"', level=3)
+            return 1
+
+        input_file = input_file if input_file else self.input_file
+        output_file = output_file if output_file else self.output_file
+        self.make_input(md, file_name=input_file)
+
+        cmdargs = ['-log', output_file, '-screen', 'none']
+        if gpu > 0:
+            cmdargs += ['-sf', 'gpu', '-pk', 'gpu', str(gpu)]
+        elif omp > 0:
+            cmdargs += ['-sf', 'omp', '-pk', 'omp', str(omp)]
 
         try:
-            mpi_cmd = const.mpi_cmd % 1
-            mpi_cmd = mpi_cmd.split()[0]
-
-            cmd = '%s %s -h' % (mpi_cmd, self.solver_path)
-            cp = subprocess.run([cmd], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='UTF-8')
-            lines = str(cp.stdout).splitlines()
-
-            flag = False
-            for l in lines:
-                if 'Installed packages:' in l:
-                    flag = True
-                elif flag:
-                    if 'OPENMP' in l or 'USER-OMP' in l:
-                        utils.radon_print('OPENMP package is available.', level=1)
-                        check_omp = True
-                    if 'INTEL' in l:
-                        utils.radon_print('INTEL package is available.', level=1)
-                        check_intel = True
-                    if 'OPT' in l:
-                        utils.radon_print('OPT package is available.', level=1)
-                        check_opt = True
-                    if 'GPU' in l:
-                        utils.radon_print('GPU package is available.', level=1)
-                        check_gpu = True
-
-        except:
-            try:
-                cmd = '%s -h' % self.solver_path
-                cp = subprocess.run([cmd], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='UTF-8')
-                lines = str(cp.stdout).splitlines()
+            coord, vel, cell = run_file(self.lammps_lib, input_file, self.work_dir, cmdargs)
+        except Exception as e:
+            utils.radon_print('Error termination of %s. Input file = %s; %s' % (self.get_name, input_file, e), level=3)
+            return 1
+
+        if isinstance(mol, Chem.Mol):
+            mol = self.update_mol(mol, coord, vel, cell, confId=confId)
+
+        return mol
+
+
+    @classmethod
+    def extract_state(cls, lmp):
+        """
+        LAMMPS.extract_state
+
+        Read unwrapped coordinates, velocities and cell from a LAMMPS library instance
+        (see library.extract_state)
+        """
+
+        return extract_state(lmp)
+
+
+    def check_package(self):
+        """
+        LAMMPS.check_package
+
+        Check the accelerator packages installed in the LAMMPS binary
+
+        Return:
+            boolean
+        """
+
+        probe = self.probe()
+        if probe is None:
+            utils.radon_print('Could not obtain package information of LAMMPS.', level=2)
+            return False
 
-                flag = False
-                for l in lines:
-                    if 'Installed packages:' in l:
-                        flag = True
-                    elif flag:
-                        if 'OPENMP' in l or 'USER-OMP' in l:
-                            utils.radon_print('OPENMP package is available.', level=1)
-                            check_omp = True
-                        if 'INTEL' in l:
-                            utils.radon_print('INTEL package is available.', level=1)
-                            check_intel = True
-                        if 'OPT' in l:
-                            utils.radon_print('OPT package is available.', level=1)
-                            check_opt = True
-                        if 'GPU' in l:
-                            utils.radon_print('GPU package is available.', level=1)
-                            check_gpu = True
-
-            except:
-                utils.radon_print('Could not obtain package information of LAMMPS.', level=2)
-                return False
-
-        self.package['omp'] = check_omp
-        self.package['intel'] = check_intel
-        self.package['opt'] = check_opt
-        self.package['gpu'] = check_gpu
+        names = {'omp': 'OPENMP', 'intel': 'INTEL', 'opt': 'OPT', 'gpu': 'GPU'}
+        for k, v in probe['package'].items():
+            if v:
+                utils.radon_print('%s package is available.' % names[k], level=1)
+            self.package[k] = v
 
         return True
 
 
     def get_version(self):
+        """
+        LAMMPS.get_version
 
-        ver = None
-        try:
-            mpi_cmd = const.mpi_cmd % 1
-            cmd = '%s %s -h' % (mpi_cmd, self.solver_path)
-            cp = subprocess.run([cmd], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='UTF-8')
-            lines = str(cp.stdout).splitlines()
-
-            for l in lines:
-                if 'Large-scale Atomic/Molecular Massively Parallel Simulator' in l:
-                    ver = '%s%s%s' % (str(l.split()[6]), str(l.split()[7]), str(l.split()[8]))
-        except:
+        Return:
+            Version string of the LAMMPS binary, or None
+        """
+
+        probe = self.probe()
+        return probe['version'] if probe else None
+
+
+    def probe(self, force=False):
+        """
+        LAMMPS.probe
+
+        Installed packages and version of the LAMMPS binary from "lmp -h".
+        Results are cached on disk in probe_file, keyed by the resolved binary path,
+        its size and mtime, and the MPI launcher, so they are shared across processes
+        and invalidated when the binary is rebuilt.
+
+        Optional args:
+            force: Ignore cached results (boolean)
+
+        Return:
+            dict {'package': {'omp', 'intel', 'opt', 'gpu'}, 'version'}, or None
+        """
+
+        key = self.probe_key()
+        cache = self.load_probe_cache()
+        if key is not None and key in cache and not force:
+            return cache[key]
+
+        lines = None
+        for cmd in ['%s %s -h' % (const.mpi_cmd % 1, self.solver_path), '%s -h' % self.solver_path]:
             try:
-                cmd = '%s -h' % self.solver_path
                 cp = subprocess.run([cmd], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='UTF-8')
+            except Exception:
+                continue
+            if 'Installed packages:' in cp.stdout:
                 lines = str(cp.stdout).splitlines()
+                break
+        if lines is None:
+            return None
+
+        result = {'package': self.parse_packages(lines), 'version': self.parse_version(lines)}
+
+        if key is not None:
+            # Entries of an older build of the same binary are replaced
+            path = key.split('|')[0]
+            cache = {k: v for k, v in self.load_probe_cache().items() if k.split('|')[0] != path}
+            cache[key] = result
+            try:
+                os.makedirs(os.path.dirname(self.probe_file), exist_ok=True)
+                tmp_file = '%s.%i.tmp' % (self.probe_file, os.getpid())
+                with open(tmp_file, 'w') as fh:
+                    json.dump(cache, fh, indent=1)
+                os.replace(tmp_file, self.probe_file)
+            except OSError as e:
+                utils.radon_print('Can not write probe cache %s; %s' % (self.probe_file, e), level=2)
 
-                for l in lines:
-                    if 'Large-scale Atomic/Molecular Massively Parallel Simulator' in l:
-                        ver = '%s%s%s' % (str(l.split()[6]), str(l.split()[7]), str(l.split()[8]))
-            except:
-                return ver
+        return result
+
+
+    def probe_key(self):
+        """
+        LAMMPS.probe_key
+
+        Key of the probe cache: resolved binary path, size, mtime and MPI launcher
+
+        Return:
+            Key (str), or None if the binary can not be found
+        """
+
+        solver = shutil.which(self.solver_path)
+        if solver is None:
+            return None
+        solver = os.path.realpath(solver)
+        st = os.stat(solver)
+
+        return '%s|%i|%i|%s' % (solver, st.st_size, st.st_mtime_ns, const.mpi_cmd % 1)
+
+
+    def load_probe_cache(self):
+        """
+        LAMMPS.load_probe_cache
+
+        Return:
+            Probe results stored on disk (dict)
+        """
+
+        if os.path.isfile(self.probe_file):
+            try:
+                with open(self.probe_file, 'r') as fh:
+                    return json.load(fh)
+            except (OSError, ValueError):
+                utils.radon_print('Can not read probe cache %s.' % self.probe_file, level=2)
+
+        return {}
+
+
+    @classmethod
+    def parse_packages(cls, lines):
+        """
+        LAMMPS.parse_packages
+
+        Args:
+            lines: Output lines of "lmp -h"
+
+        Return:
+            dict of available accelerator packages {'omp', 'intel', 'opt', 'gpu'}
+        """
+
+        package = {'omp': False, 'intel': False, 'opt': False, 'gpu': False}
+
+        flag = False
+        for l in lines:
+            if 'Installed packages:' in l:
+                flag = True
+            elif flag:
+                if 'OPENMP' in l or 'USER-OMP' in l:
+                    package['omp'] = True
+                if 'INTEL' in l:
+                    package['intel'] = True
+                if 'OPT' in l:
+                    package['opt'] = True
+                if 'GPU' in l:
+                    package['gpu'] = True
+
+        return package
+
+
+    @classmethod
+    def parse_version(cls, lines):
+        """
+        LAMMPS.parse_version
+
+        Args:
+            lines: Output lines of "lmp -h"
+
+        Return:
+            Version string, or None
+        """
+
+        ver = None
+        for l in lines:
+            if 'Large-scale Atomic/Molecular Massively Parallel Simulator' in l:
+                ver = '%s%s%s' % (str(l.split()[6]), str(l.split()[7]), str(l.split()[8]))
 
         return ver
-        
+
+
+    def autotune(self, input_file=None, mpi_list=None, omp_list=None, gpu=0, steps=500, node_type=None, force=False):
+        """
+        LAMMPS.autotune
+
+        Find the fastest combination of MPI processes, OpenMP threads and accelerator
+        package by short trial runs of the actual input. The result is cached on disk,
+        keyed by atom count, pair/kspace style and node type, and reused by later calls.
+
+        Optional args:
+            input_file: Input file path (str)
+            mpi_list: Candidate numbers of MPI process (list of int)
+            omp_list: Candidate numbers of openMP thread (list of int)
+            gpu: Number of GPU (int)
+            steps: Number of steps of each trial run (int)
+            node_type: Name of the node type (str), detected from the CPU model if None
+            force: Ignore cached results (boolean)
+
+        Return:
+            dict of the fastest configuration (mpi, omp, gpu, intel, opt, ts_per_sec)
+        """
+
+        global autotune_cache
+        input_file = input_file if input_file else self.input_file
+        key = self.autotune_key(input_file, node_type=node_type)
+
+        if key not in autotune_cache:
+            self.load_autotune_cache()
+
+        if not force and key in autotune_cache:
+            return autotune_cache[key]
+
+        # By default, every split of all cores into MPI processes x OpenMP threads
+        ncpu = utils.cpu_count()
+        divisors = [n for n in range(1, ncpu+1) if ncpu % n == 0]
+        if mpi_list is None and omp_list is None:
+            pairs = [(n, ncpu // n) for n in divisors]
+        else:
+            pairs = [(m, o) for m in (mpi_list if mpi_list else divisors) for o in (omp_list if omp_list else divisors)]
+        if gpu > 0 and not self.package['gpu']:
+            gpu = 0
+
+        suffixes = [('off', 'off')]
+        if self.package['intel']:
+            suffixes.append(('on', 'off'))
+        if self.package['opt']:
+            suffixes.append(('off', 'on'))
+
+        candidates = []
+        for mpi, omp in pairs:
+            if mpi * omp > ncpu or (omp > 1 and not self.package['omp']):
+                continue
+            for intel, opt in suffixes:
+                candidates.append({'mpi': mpi, 'omp': omp if omp > 1 else 0, 'gpu': gpu, 'intel': intel, 'opt': opt})
+
+        trial_input = '%s.tune' % os.path.basename(input_file)
+        trial_output = '%s.tune.log' % os.path.basename(input_file)
+        self.make_trial_input(os.path.join(self.work_dir, input_file), os.path.join(self.work_dir, trial_input), steps)
+
+        best = None
+        for cand in candidates:
+            trial_log = os.path.join(self.work_dir, trial_output)
+            if os.path.isfile(trial_log):
+                os.remove(trial_log)
+            cp = self.exec(input_file=trial_input, output_file=trial_output, omp=cand['omp'], mpi=cand['mpi'],
+                           gpu=cand['gpu'], intel=cand['intel'], opt=cand['opt'])
+            if cp.returncode != 0:
+                utils.radon_print('Trial run failed: mpi=%i omp=%i intel=%s opt=%s'
+                    % (cand['mpi'], cand['omp'], cand['intel'], cand['opt']), level=1)
+                continue
+
+            cand['ts_per_sec'] = self.read_performance(trial_log)
+            utils.radon_print('Trial run: mpi=%i omp=%i intel=%s opt=%s -> %s timesteps/s'
+                % (cand['mpi'], cand['omp'], cand['intel'], cand['opt'], str(cand['ts_per_sec'])), level=1)
+            if cand['ts_per_sec'] is not None and (best is None or cand['ts_per_sec'] > best['ts_per_sec']):
+                best = cand
+
+        for f in [trial_input, trial_output]:
+            if os.path.isfile(os.path.join(self.work_dir, f)):
+                os.remove(os.path.join(self.work_dir, f))
+
+        if best is None:
+            utils.radon_print('Autotuning of LAMMPS failed. Input file = %s' % input_file, level=2)
+            return None
+
+        self.load_autotune_cache()
+        autotune_cache[key] = best
+        try:
+            os.makedirs(os.path.dirname(self.autotune_file), exist_ok=True)
+            tmp_file = '%s.%i.tmp' % (self.autotune_file, os.getpid())
+            with open(tmp_file, 'w') as fh:
+                json.dump(autotune_cache, fh, indent=1)
+            os.replace(tmp_file, self.autotune_file)
+        except OSError as e:
+            utils.radon_print('Can not write autotune cache %s; %s' % (self.autotune_file, e), level=2)
+
+        return best
+
+
+    def load_autotune_cache(self):
+        """
+        LAMMPS.load_autotune_cache
+
+        Merge autotune results stored on disk (possibly by other processes) into the cache
+        """
+
+        global autotune_cache
+        if os.path.isfile(self.autotune_file):
+            try:
+                with open(self.autotune_file, 'r') as fh:
+                    autotune_cache.update(json.load(fh))
+            except (OSError, ValueError):
+                utils.radon_print('Can not read autotune cache %s.' % self.autotune_file, level=2)
+
+        return autotune_cache
+
+
+    def autotune_key(self, input_file, node_type=None):
+        """
+        LAMMPS.autotune_key
+
+        Key of the autotune cache: atom count, pair/kspace style and node type
+
+        Args:
+            input_file: Input file path (str)
+
+        Optional args:
+            node_type: Name of the node type (str)
+
+        Return:
+            str
+        """
+
+        pair_style = kspace_style = dat_file = ''
+        with open(os.path.join(self.work_dir, input_file), 'r') as fh:
+            for line in fh:
+                words = line.split()
+                if len(words) < 2:
+                    continue
+                if words[0] == 'pair_style':
+                    pair_style = words[1]
+                elif words[0] == 'kspace_style':
+                    kspace_style = words[1]
+                elif words[0] in ['read_data', 'read_restart']:
+                    dat_file = words[1]
+
+        natoms = 0
+        dat_path = os.path.join(self.work_dir, dat_file)
+        if dat_file and os.path.isfile(dat_path):
+            with open(dat_path, 'r', errors='ignore') as fh:
+                for i, line in enumerate(fh):
+                    if line.strip().endswith(' atoms'):
+                        natoms = int(line.split()[0])
+                        break
+                    if i > 50: break
+
+        if node_type is None:
+            node_type = ''
+            if os.path.isfile('/proc/cpuinfo'):
+                with open('/proc/cpuinfo', 'r') as fh:
+                    for line in fh:
+                        if line.startswith('model name'):
+                            node_type = line.split(':', 1)[1].strip()
+                            break
+            node_type = '%s x%i' % (node_type, utils.cpu_count())
+
+        solver = shutil.which(self.solver_path) or self.solver_path
+        return '%i|%s|%s|%s|%s' % (natoms, pair_style, kspace_style, node_type, os.path.realpath(solver))
+
+
+    @classmethod
+    def make_trial_input(cls, input_file, trial_file, steps):
+        """
+        LAMMPS.make_trial_input
+
+        Copy an input file with every run and minimization shortened to the given steps
+        and without output of dump, restart, log and data files
+        """
+
+        skip = ['log', 'dump', 'dump_modify', 'undump', 'restart', 'write_restart', 'write_dump', 'write_data']
+        lines = []
+        with open(input_file, 'r') as fh:
+            for line in fh:
+                words = line.split()
+                if len(words) == 0:
+                    lines.append(line)
+                elif words[0] in skip:
+                    continue
+                elif words[0] == 'run':
+                    lines.append('run %i\n' % steps)
+                elif words[0] == 'minimize' and len(words) >= 5:
+                    lines.append('minimize %s %s %i %i\n' % (words[1], words[2], steps, steps))
+                else:
+                    lines.append(line)
+
+        with open(trial_file, 'w') as fh:
+            fh.write(''.join(lines))
+
+        return trial_file
+
+
+    @classmethod
+    def read_performance(cls, log_file):
+        """
+        LAMMPS.read_performance
+
+        Mean of timesteps/s of the performance lines in a log file
+
+        Return:
+            float (None if no performance line)
+        """
+
+        perf = []
+        with open(log_file, 'r', errors='ignore') as fh:
+            for line in fh:
+                if line.startswith('Performance:'):
+                    m = re.search(r'([0-9.eE+-]+) timesteps/s', line)
+                    if m:
+                        perf.append(float(m.group(1)))
+
+        return float(np.mean(perf)) if perf else None
+
 
     def make_dat(self, mol, confId=0, file_name=None, dir_name=None, velocity=True, temp=300, drude=False):
         """
@@ -912,17 +1579,19 @@ class LAMMPS():
         return indata, unfix
 
 
-    def read_traj_last(self, filename, b_size=64):
+    def read_traj_last(self, filename, b_size=65536):
         """
         LAMMPS.read_traj_last
 
         tail command like reading routine of trajectory data
+        The last frame is located with a reverse scan of a memory map in growing blocks,
+        and its atoms are parsed in bulk
 
         Args:
             filename: Path of trajectory file
 
         Optional args:
-            b_size: buffer size
+            b_size: initial block size of the reverse scan (doubled until a frame header is found)
 
         Return:
             Unwrapped atomic coordinates
@@ -932,81 +1601,49 @@ class LAMMPS():
             Force on atoms
         """
 
-        line = b''
+        if is_compressed(filename):
+            # Compressed streams can not be read backwards
+            with open_dump(filename, 'rb') as fh:
+                data = fh.read()
+            return self._traj_arrays(parse_dump_frame(data[data.rfind(b'ITEM: TIMESTEP'):]))
+
+        if os.path.getsize(filename) == 0:
+            return False
+
+        if os.path.isfile(filename + DumpIndex.suffix):
+            index = DumpIndex(filename)
+            index.update()
+            return self._traj_arrays(index.frame(-1, sort=False)) if len(index) else False
 
         with open(filename, 'rb') as fh:
-            fh.seek(0, 2)
-            n = int(fh.tell() / b_size)
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = find_last_frame(mm, b_size)
+                if start < 0:
+                    return False
+                frame = parse_dump_frame(mm[start:])
 
-            for i in range(n):
-                fh.seek(-b_size, 1)
-                data = fh.read(b_size)
-                line = data + line
-                text = line.decode()
-                fh.seek(-b_size, 1)
-
-                if 'ITEM: TIMESTEP' in text: break
-
-        flag_cell = False
-        flag_atoms = False
-        cell = []
-        atoms = []
-        lines = text.split('\n')
-        for line in lines:
-            if line == '':
-                continue
-            elif 'ITEM: BOX BOUNDS' in line:
-                pbc = line.split(' ')[3:]
-                flag_cell = True
-                flag_atoms = False
-            elif 'ITEM: ATOMS' in line:
-                atoms_column = line.split(' ')[2:]
-                flag_cell = False
-                flag_atoms = True
-            elif flag_cell:
-                cell.append([float(f) for f in line.split(' ')])
-            elif flag_atoms:
-                atoms.append(line.split(' '))
-
-        if 'id' in atoms_column:
-            id_idx = atoms_column.index('id')
-        else:
+        return self._traj_arrays(frame)
+
+
+    def _traj_arrays(self, frame):
+        if frame is None or 'id' not in frame['columns']:
             return False
-        x_idx = atoms_column.index('x') if 'x' in atoms_column else None
-        y_idx = atoms_column.index('y') if 'y' in atoms_column else None
-        z_idx = atoms_column.index('z') if 'z' in atoms_column else None
-        xu_idx = atoms_column.index('xu') if 'xu' in atoms_column else None
-        yu_idx = atoms_column.index('yu') if 'yu' in atoms_column else None
-        zu_idx = atoms_column.index('zu') if 'zu' in atoms_column else None
-        vx_idx = atoms_column.index('vx') if 'vx' in atoms_column else None
-        vy_idx = atoms_column.index('vy') if 'vy' in atoms_column else None
-        vz_idx = atoms_column.index('vz') if 'vz' in atoms_column else None
-        fx_idx = atoms_column.index('fx') if 'fx' in atoms_column else None
-        fy_idx = atoms_column.index('fy') if 'fy' in atoms_column else None
-        fz_idx = atoms_column.index('fz') if 'fz' in atoms_column else None
-
-        num = len(atoms)
-        uwstr = np.array([[0] * 3 for i in range(num)], dtype=float)
-        wstr = np.array([[0] * 3 for i in range(num)], dtype=float)
-        v = np.array([[0] * 3 for i in range(num)], dtype=float)
-        f = np.array([[0] * 3 for i in range(num)], dtype=float)
-
-        for atom in atoms:
-            atom_id = int(atom[id_idx])-1
-            wstr[atom_id, 0] = float(atom[x_idx]) if x_idx is not None else 0
-            wstr[atom_id, 1] = float(atom[y_idx]) if y_idx is not None else 0
-            wstr[atom_id, 2] = float(atom[z_idx]) if z_idx is not None else 0
-            uwstr[atom_id, 0] = float(atom[xu_idx]) if xu_idx is not None else 0
-            uwstr[atom_id, 1] = float(atom[yu_idx]) if yu_idx is not None else 0
-            uwstr[atom_id, 2] = float(atom[zu_idx]) if zu_idx is not None else 0
-            v[atom_id, 0] = float(atom[vx_idx]) if vx_idx is not None else 0
-            v[atom_id, 1] = float(atom[vy_idx]) if vy_idx is not None else 0
-            v[atom_id, 2] = float(atom[vz_idx]) if vz_idx is not None else 0
-            f[atom_id, 0] = float(atom[fx_idx]) if fx_idx is not None else 0
-            f[atom_id, 1] = float(atom[fy_idx]) if fy_idx is not None else 0
-            f[atom_id, 2] = float(atom[fz_idx]) if fz_idx is not None else 0
-
-        return uwstr, wstr, np.array(cell), v, f
+
+        columns = frame['columns']
+        data = frame['data']
+        num = len(data)
+        idx = data[:, columns.index('id')].astype(int) - 1
+
+        arrays = []
+        for names in (('xu', 'yu', 'zu'), ('x', 'y', 'z'), ('vx', 'vy', 'vz'), ('fx', 'fy', 'fz')):
+            arr = np.zeros((num, 3), dtype=float)
+            for j, name in enumerate(names):
+                if name in columns:
+                    arr[idx, j] = data[:, columns.index(name)]
+            arrays.append(arr)
+
+        uwstr, wstr, v, f = arrays
+        return uwstr, wstr, frame['box'], v, f
 
 
     def read_traj_simple(self, filename):
@@ -1014,6 +1651,7 @@ class LAMMPS():
         LAMMPS.read_traj_simple
 
         Simple reading routine of trajectory data
+        Frames are streamed by iter_dump, and the last frame of the file is returned
 
         Args:
             filename: Path of trajectory file
@@ -1026,71 +1664,11 @@ class LAMMPS():
             Force on atoms
         """
 
-        with open(filename, "r") as fh:
-            lines = [s.replace('\n', '').replace('\r', '') for s in fh.readlines()]
+        frame = None
+        for frame in iter_dump(filename, sort=False):
+            pass
 
-        flag_cell = False
-        flag_atoms = False
-        cell = []
-        atoms = []
-        for line in lines:
-            if line == '':
-                continue
-            elif 'ITEM: TIMESTEP' in line:
-                flag_cell = False
-                flag_atoms = False
-            elif 'ITEM: BOX BOUNDS' in line:
-                pbc = line.split(' ')[3:]
-                flag_cell = True
-                flag_atoms = False
-            elif 'ITEM: ATOMS' in line:
-                atoms_column = line.split(' ')[2:]
-                flag_cell = False
-                flag_atoms = True
-            elif flag_cell:
-                cell.append([float(f) for f in line.split(' ')])
-            elif flag_atoms:
-                atoms.append(line.split(' '))
-
-        if 'id' in atoms_column:
-            id_idx = atoms_column.index('id')
-        else:
-            return False
-        x_idx = atoms_column.index('x') if 'x' in atoms_column else None
-        y_idx = atoms_column.index('y') if 'y' in atoms_column else None
-        z_idx = atoms_column.index('z') if 'z' in atoms_column else None
-        xu_idx = atoms_column.index('xu') if 'xu' in atoms_column else None
-        yu_idx = atoms_column.index('yu') if 'yu' in atoms_column else None
-        zu_idx = atoms_column.index('zu') if 'zu' in atoms_column else None
-        vx_idx = atoms_column.index('vx') if 'vx' in atoms_column else None
-        vy_idx = atoms_column.index('vy') if 'vy' in atoms_column else None
-        vz_idx = atoms_column.index('vz') if 'vz' in atoms_column else None
-        fx_idx = atoms_column.index('fx') if 'fx' in atoms_column else None
-        fy_idx = atoms_column.index('fy') if 'fy' in atoms_column else None
-        fz_idx = atoms_column.index('fz') if 'fz' in atoms_column else None
-
-        num = len(atoms)
-        uwstr = np.array([[0] * 3 for i in range(num)], dtype=float)
-        wstr = np.array([[0] * 3 for i in range(num)], dtype=float)
-        v = np.array([[0] * 3 for i in range(num)], dtype=float)
-        f = np.array([[0] * 3 for i in range(num)], dtype=float)
-
-        for atom in atoms:
-            atom_id = int(atom[id_idx])-1
-            wstr[atom_id, 0] = float(atom[x_idx]) if x_idx is not None else 0
-            wstr[atom_id, 1] = float(atom[y_idx]) if y_idx is not None else 0
-            wstr[atom_id, 2] = float(atom[z_idx]) if z_idx is not None else 0
-            uwstr[atom_id, 0] = float(atom[xu_idx]) if xu_idx is not None else 0
-            uwstr[atom_id, 1] = float(atom[yu_idx]) if yu_idx is not None else 0
-            uwstr[atom_id, 2] = float(atom[zu_idx]) if zu_idx is not None else 0
-            v[atom_id, 0] = float(atom[vx_idx]) if vx_idx is not None else 0
-            v[atom_id, 1] = float(atom[vy_idx]) if vy_idx is not None else 0
-            v[atom_id, 2] = float(atom[vz_idx]) if vz_idx is not None else 0
-            f[atom_id, 0] = float(atom[fx_idx]) if fx_idx is not None else 0
-            f[atom_id, 1] = float(atom[fy_idx]) if fy_idx is not None else 0
-            f[atom_id, 2] = float(atom[fz_idx]) if fz_idx is not None else 0
-
-        return uwstr, wstr, np.array(cell), v, f
+        return self._traj_arrays(frame)
 
 
 
@@ -1101,13 +1679,14 @@ class LAMMPS():
 
 class Analyze():
     def __init__(self, log_file='radon_md.log', **kwargs):
-        self.dfs = self.read_log(log_file)
+        self.dfs = self.read_log(log_file) if log_file else []
         self.log_file = log_file
         self.in_file = kwargs.get('in_file', 'radon_md.dump')
         self.dat_file = kwargs.get('dat_file', 'radon_md_lmp.data')
         self.traj_file = kwargs.get('traj_file', 'radon_md.dump')
         self.rg_file = kwargs.get('rg_file', 'rg.profile')
         self.pdb_file = kwargs.get('pdb_file', 'topology.pdb')
+        self.store_file = kwargs.get('store_file', None)
 
         self.traj = None
         self.charges = np.array([])
@@ -1837,32 +2416,115 @@ class Analyze():
         return diffc
 
 
-    def read_traj(self, traj_file=None, pdb_file=None, traj_type=None):
+    def read_traj(self, traj_file=None, pdb_file=None, traj_type=None, frames=None):
+        """
+        Analyze.read_traj
+
+        Read trajectory files by mdtraj
+
+        Optional args:
+            traj_file: Path, glob pattern or list of trajectory files.
+                       Text dumps may be gzip (.gz) or zstd (.zst) compressed,
+                       and segmented runs write one file per segment.
+                       A trajectory store written by convert_traj is read lazily,
+                       and is used instead of the text files if store_file is set.
+            pdb_file: Path of topology file
+            traj_type: dump, xtc, dcd or store (str)
+            frames: slice or list of frames to read from a store
+
+        Return:
+            mdtraj.Trajectory
+        """
 
         if not mdtraj_avail:
             utils.radon_print('mdtraj is not available. You can use read_traj by "conda install -c conda-forge mdtraj"', level=3)
             return None
 
         if traj_file is None:
-            traj_file = self.traj_file
+            traj_file = self.store_file if self.store_file and is_store(self.store_file) else self.traj_file
         if pdb_file is None:
             pdb_file = self.pdb_file
 
+        if traj_type == 'store' or is_store(traj_file):
+            self.traj = self.read_store(traj_file, pdb_file, frames)
+            return self.traj
+
+        traj_files = traj_file_list(traj_file)
+        if len(traj_files) == 0:
+            utils.radon_print('Trajectory file %s is not found' % traj_file, level=3)
+            return None
+
         if traj_type is None:
-            if 'dump' in traj_file: traj_type = 'dump'
-            elif 'xtc' in traj_file: traj_type = 'xtc'
+            name = traj_files[0]
+            if 'dump' in name or 'lammpstrj' in name: traj_type = 'dump'
+            elif 'xtc' in name: traj_type = 'xtc'
+            elif 'dcd' in name: traj_type = 'dcd'
             else:
-                utils.radon_print('read_traj can not specified the format of trajectory file %s' % traj_file, level=3)
+                utils.radon_print('read_traj can not specified the format of trajectory file %s' % name, level=3)
                 return None
 
-        if traj_type == 'dump':
-            self.traj = mdtraj.load_lammpstrj(traj_file, top=pdb_file)
-        elif traj_type == 'xtc':
-            self.traj = mdtraj.load_xtc(traj_file, top=pdb_file)
+        trajs = []
+        for name in traj_files:
+            if traj_type == 'dump':
+                if is_compressed(name):
+                    with tempfile.NamedTemporaryFile('w', suffix='.lammpstrj', delete=False) as tmp:
+                        with open_dump(name, 'rt') as fh:
+                            shutil.copyfileobj(fh, tmp)
+                    try:
+                        trajs.append(mdtraj.load_lammpstrj(tmp.name, top=pdb_file))
+                    finally:
+                        os.remove(tmp.name)
+                else:
+                    trajs.append(mdtraj.load_lammpstrj(name, top=pdb_file))
+            elif traj_type == 'xtc':
+                trajs.append(mdtraj.load_xtc(name, top=pdb_file))
+            elif traj_type == 'dcd':
+                trajs.append(mdtraj.load_dcd(name, top=pdb_file))
+
+        self.traj = trajs[0] if len(trajs) == 1 else mdtraj.join(trajs, check_topology=False)
 
         return self.traj
 
 
+    def read_store(self, store_file, pdb_file=None, frames=None, time_step=None):
+        """
+        Analyze.read_store
+
+        Read coordinates of selected frames from a trajectory store into mdtraj.
+        Only the chunks holding these frames and the coordinate columns are loaded.
+
+        Args:
+            store_file: Path of store written by convert_traj
+
+        Optional args:
+            pdb_file: Path of topology file
+            frames: slice or list of frames (all frames if None)
+            time_step: Time step of the run in fs, to give frame times in ps for stores converted
+                       from dumps; their times are the timesteps if None (float)
+
+        Return:
+            mdtraj.Trajectory
+        """
+
+        if not mdtraj_avail:
+            utils.radon_print('mdtraj is not available. You can use read_store by "conda install -c conda-forge mdtraj"', level=3)
+            return None
+
+        store = TrajStore(store_file)
+        index = np.arange(len(store))[frames if frames is not None else slice(None)]
+        # angstrom -> nm
+        xyz = store.positions(index) * 0.1
+        lengths, angles = mdtraj.utils.box_vectors_to_lengths_and_angles(*np.moveaxis(store.boxes[index] * 0.1, 1, 0))
+        if store.time_unit == 'ps' or time_step is not None:
+            time = store.times(index, time_step)
+        else:
+            time = np.asarray(store.timesteps[index], dtype=float)
+        store.close()
+
+        top = mdtraj.load_topology(pdb_file if pdb_file else self.pdb_file)
+        return mdtraj.Trajectory(xyz, top, time=time, unitcell_lengths=lengths, unitcell_angles=angles)
+
+
     def analyze_traj(self, traj, prop, conv_a=1.0, conv_b=0.0, ylabel=None, temp=300, periodic=False, charges=None, enthalpy=None,
                      init=1000, last=None, width=1000, printout=True, save=None):
 
@@ -2568,6 +3230,94 @@ class Analyze():
 
 
 
+###########################################
+# Molecule state functions
+###########################################
+
+def set_positions(conf, coord):
+    """
+    set_positions
+
+    Set all atomic positions of a conformer from an array,
+    in one call where RDKit provides Conformer.SetPositions
+
+    Args:
+        conf: RDKit Conformer object
+        coord: Atomic coordinates (numpy.ndarray, atoms x 3)
+
+    Return:
+        RDKit Conformer object
+    """
+    coord = np.ascontiguousarray(coord, dtype=float)
+    if hasattr(conf, 'SetPositions'):
+        conf.SetPositions(coord)
+    else:
+        for i, (x, y, z) in enumerate(coord.tolist()):
+            conf.SetAtomPosition(i, Geom.Point3D(x, y, z))
+
+    return conf
+
+
+def set_velocities(mol, vel):
+    """
+    set_velocities
+
+    Set atomic velocities as vx, vy and vz atom properties in one pass over the atoms,
+    and keep the array as mol.velocities to skip reading the properties back.
+    The atom properties remain the reference: they survive copies of mol, and
+    mol.velocities (a Python attribute, dropped by copies) is only a cache of them.
+
+    Args:
+        mol: RDKit Mol object
+        vel: Atomic velocities (numpy.ndarray, atoms x 3)
+
+    Return:
+        RDKit Mol object
+    """
+    vel = np.array(vel, dtype=float).reshape(-1, 3)
+    for atom, (vx, vy, vz) in zip(mol.GetAtoms(), vel.tolist()):
+        atom.SetDoubleProp('vx', vx)
+        atom.SetDoubleProp('vy', vy)
+        atom.SetDoubleProp('vz', vz)
+    setattr(mol, 'velocities', vel)
+
+    return mol
+
+
+def get_velocities(mol):
+    """
+    get_velocities
+
+    Atomic velocities of mol from vx, vy and vz atom properties.
+    mol.velocities is used instead when it agrees with the properties of the first and last atoms,
+    so velocities written later through the properties (e.g. by calc.set_velocity) are not shadowed by it.
+
+    Args:
+        mol: RDKit Mol object
+
+    Return:
+        Atomic velocities (numpy.ndarray, atoms x 3), or None if mol has no velocities
+    """
+    n = mol.GetNumAtoms()
+    if n == 0 or not mol.GetAtomWithIdx(0).HasProp('vx'):
+        return None
+
+    vel = getattr(mol, 'velocities', None)
+    if vel is not None and len(vel) == n:
+        for i in (0, n-1):
+            atom = mol.GetAtomWithIdx(i)
+            if [atom.GetDoubleProp('vx'), atom.GetDoubleProp('vy'), atom.GetDoubleProp('vz')] != vel[i].tolist():
+                break
+        else:
+            return vel
+
+    vel = np.array([[atom.GetDoubleProp('vx'), atom.GetDoubleProp('vy'), atom.GetDoubleProp('vz')]
+                    for atom in mol.GetAtoms()])
+    setattr(mol, 'velocities', vel)
+    return vel
+
+
+
 ###########################################
 # IO functions
 ###########################################
@@ -2809,14 +3559,13 @@ def MolToLAMMPSdataBlock(mol, confId=0, velocity=True, temp=300, drude=False):
             lines.append('Velocities')
             lines.append('')
 
-            if not mol.GetAtomWithIdx(0).HasProp('vx'):
+            vel = get_velocities(mol)
+            if vel is None:
                 calc.set_velocity(mol, temp)
+                vel = get_velocities(mol)
 
-            for atom in mol.GetAtoms():
-                vx = atom.GetDoubleProp('vx')
-                vy = atom.GetDoubleProp('vy')
-                vz = atom.GetDoubleProp('vz')
-                lines.append('%5d\t% .16e\t% .16e\t% .16e' % (atom.GetIdx()+1, vx, vy, vz))
+            for i, (vx, vy, vz) in enumerate(vel.tolist()):
+                lines.append('%5d\t% .16e\t% .16e\t% .16e' % (i+1, vx, vy, vz))
 
 
     if mol.GetNumBonds() > 0:
@@ -3309,11 +4058,8 @@ def MolFromLAMMPSdata(file_name, bond_order=True,
 
     conf = Chem.rdchem.Conformer(n_data['atoms'])
     conf.Set3D(True)
-    for i in range(n_data['atoms']):
-        x = coord[i][0] + mol.cell.dx * pbc[i][0]
-        y = coord[i][1] + mol.cell.dy * pbc[i][1]
-        z = coord[i][2] + mol.cell.dz * pbc[i][2]
-        conf.SetAtomPosition(i, Geom.Point3D(x, y, z))
+    cell_len = np.array([mol.cell.dx, mol.cell.dy, mol.cell.dz])
+    set_positions(conf, np.array(coord, dtype=float).reshape(-1, 3) + cell_len * np.array(pbc, dtype=float).reshape(-1, 3))
     conf_id = mol.AddConformer(conf, assignId=True)
     mol = calc.mol_trans_in_cell(mol, confId=conf_id)
 
@@ -1,11 +1,20 @@
+import hashlib
+import logging
+import math
+import os
+import shutil
+import tempfile
 from pathlib import Path
 from typing import Dict, List, Optional, Union
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 import yaml
 try:
     from automate.slurm_automation import SlurmJobManager
 except ImportError:
     from workflow.core.slurm_automation import SlurmJobManager  # Changed from relative to absolute import
+from workflow.core.slurm_automation import CHECKPOINT_EXIT_CODE
+from workflow.core.slurm_accounting import parse_slurm_time, format_slurm_time
+from workflow.lammps.validate import ValidationCache, skiprun, validation_key
     
 @dataclass
 class SimulationParameters:
@@ -23,6 +32,12 @@ class SimulationParameters:
     thermo_freq: int = 1000
     dump_freq: int = 1000
     restart_freq: int = 10000
+    restart_mode: str = "series"  # "series" of numbered files or two "toggle" files
+    restart_keep_every: Optional[int] = None  # with toggle restarts, also keep every k-th snapshot
+    
+    # Trajectory output
+    dump_mode: str = "per_frame"  # "per_frame", "single", "gz", "zstd", "xtc" or "dcd"
+    dump_columns: Optional[Dict[str, str]] = None  # per-phase columns of text dumps
     
     # Force field parameters
     pair_style: str = "lj/cut/coul/long"
@@ -42,11 +57,68 @@ class SimulationParameters:
     cpus_per_task: int = 4
     memory: str = "16G"
     time_limit: str = "48:00:00"
+    
+    # Resource prediction from Slurm accounting history
+    n_atoms: Optional[int] = None
+    auto_resources: bool = False  # replace memory/time_limit by predictions when history is available
+    resource_margin: float = 1.3
+    
+    # Segmented runs for phases longer than the wall-time limit
+    steps_per_hour: Optional[float] = None  # measured performance, used to size segments
+    max_segment_steps: Optional[int] = None  # explicit segment length, overrides steps_per_hour
+    segment_time_fraction: float = 0.9  # fraction of time_limit a segment may use
+    max_resubmits: int = 3  # resubmissions of a segment that hit TIMEOUT
+    
+    # Checkpointing on Slurm time-limit/preemption signals
+    checkpoint_signal_lead: Optional[int] = None  # seconds before the time limit to signal the job
+    checkpoint_action: str = "requeue"  # "requeue" the same job or "resubmit" a continuation
+    checkpoint_timer: bool = False  # also stop with LAMMPS "timer timeout" in case the signal is lost
+    checkpoint_check_freq: int = 100  # steps between checks of the halt flag
+    
+    # Running all phases as one job
+    fuse_phases: Optional[bool] = None  # None: fuse when the estimated total runtime fits the limit
+    partition_time_limit: Optional[str] = None  # maximum time limit of the partition, defaults to time_limit
+    
+    # Multi-replica MD phases in one mpirun (LAMMPS -partition), each replica with ntasks processes
+    replicas: int = 1
+    replica_temperatures: Optional[List[float]] = None  # one per replica, defaults to temperature
+    replica_seeds: Optional[List[int]] = None  # velocity seeds, defaults to velocity_seed + replica index
+    velocity_seed: int = 12345
+    
+    # Convergence-driven equilibration
+    equilibration_tolerance: Optional[float] = None  # stop once block-averaged density changes less than this fraction
+    equilibration_block: int = 50000  # steps per convergence check
+    
+    # Early stop of equilibration once Analyze convergence criteria are met (workflow.lammps.monitor)
+    monitor_properties: Optional[List[str]] = None  # e.g. ["totene", "dens"]
+    monitor_init: int = 100  # thermo rows skipped before checking
+    monitor_width: int = 100  # thermo rows of the moving average
+    monitor_interval: float = 60.0  # seconds between checks of the log
+    monitor_check_freq: int = 1000  # steps between checks of the CONVERGED flag by LAMMPS
+    
+    # Dry run of the inputs with lmp -skiprun before submission
+    validate_inputs: bool = False
 
 class LammpsWorkflow:
-    def __init__(self, base_dir: str = "."):
+    phases = ["minimization", "equilibration", "production"]
+    phase_prefix = {"minimization": "min", "equilibration": "equ", "production": "prod"}
+    dump_columns = "id type x y z vx vy vz"
+    dump_styles = {
+        "per_frame": ("custom", "lammpstrj"),
+        "single": ("custom", "lammpstrj"),
+        "gz": ("custom/gz", "lammpstrj.gz"),
+        "zstd": ("custom/zstd", "lammpstrj.zst"),
+        "xtc": ("xtc", "xtc"),
+        "dcd": ("dcd", "dcd"),
+    }
+
+    def __init__(self, base_dir: str = ".", slurm_manager: Optional[SlurmJobManager] = None,
+                 initial_restart: Optional[str] = None,
+                 history_file: Optional[str] = None):
         self.base_dir = Path(base_dir)
-        self.slurm_manager = SlurmJobManager(max_concurrent_jobs=10)
+        self.initial_restart = initial_restart  # restart the first phase starts from instead of system.data
+        self.slurm_manager = slurm_manager if slurm_manager else SlurmJobManager(max_concurrent_jobs=10,
+                                                                                 history_file=history_file)
         self.setup_directories()
         
     def setup_directories(self):
@@ -65,29 +137,248 @@ class LammpsWorkflow:
         for dir_path in dirs:
             (self.base_dir / dir_path).mkdir(parents=True, exist_ok=True)
 
-    def create_lammps_script(self, phase: str, params: SimulationParameters) -> str:
+    def create_lammps_script(self, phase: str, params: SimulationParameters, allow_segments: bool = True) -> str:
         """Create LAMMPS input script for a specific phase"""
         script_path = self.base_dir / "input_files" / f"{phase}.in"
+        segmented = allow_segments and bool(self.segment_ends(phase, params))
         
         content = self._generate_header(params)
-        content += self._generate_system_setup()
+        if self.is_replicated(phase, params):
+            content += self._generate_replicas(params)
+        if segmented:
+            content += self._generate_resumable_setup(phase)
+        else:
+            content += self._generate_system_setup(self.phase_source(phase, self.replica_var(phase, params)))
         content += self._generate_force_field(params)
         
         if phase == "minimization":
             content += self._generate_minimization(params)
         elif phase == "equilibration":
-            content += self._generate_equilibration(params)
+            content += self._generate_equilibration(params, segmented)
         elif phase == "production":
-            content += self._generate_production(params)
+            content += self._generate_production(params, segmented)
             
-        with open(script_path, "w") as f:
-            f.write(content)
+        self.write_file(script_path, content)
             
         return str(script_path)
 
-    def create_submission_script(self, phase: str, params: SimulationParameters) -> str:
-        """Create submission script for a specific phase"""
-        script_path = self.base_dir / "scripts" / f"submit_{phase}.sh"
+    def write_file(self, path: Path, content: str) -> bool:
+        """Write content unless the file already holds it, so unchanged files keep their mtime"""
+        path = Path(path)
+        if path.exists() and path.read_text() == content:
+            return False
+        path.write_text(content)
+        return True
+
+    def is_replicated(self, phase: str, params: Optional[SimulationParameters]) -> bool:
+        """Check whether a phase runs as several replicas (MD phases only, minimization runs once)"""
+        return params is not None and params.replicas > 1 and phase != "minimization"
+
+    def replica_ids(self, phase: str, params: Optional[SimulationParameters] = None) -> List[Optional[int]]:
+        """Return the replica indices of a phase, [None] when it is not replicated"""
+        return list(range(params.replicas)) if self.is_replicated(phase, params) else [None]
+
+    def replica_var(self, phase: str, params: SimulationParameters) -> Optional[str]:
+        """Return the LAMMPS reference to the replica index in inputs of a replicated phase"""
+        return "${replica}" if self.is_replicated(phase, params) else None
+
+    def file_prefix(self, phase: str, params: SimulationParameters) -> str:
+        """Return the prefix of output files of a phase, including the replica index if replicated"""
+        replica = self.replica_var(phase, params)
+        return self.phase_prefix[phase] + (f".r{replica}" if replica else "")
+
+    def final_restart(self, phase: str, replica: Optional[Union[int, str]] = None) -> str:
+        """Return the restart file written at the end of a phase (by one replica)"""
+        if phase == "minimization":
+            return "minimization/min.restart"
+        prefix = self.phase_prefix[phase] + (f".r{replica}" if replica is not None else "")
+        return f"{phase}/{prefix}.final.restart"
+
+    def phase_source(self, phase: str, replica: Optional[Union[int, str]] = None) -> Optional[str]:
+        """Return the restart file a phase starts from, or None to start from system.data"""
+        index = self.phases.index(phase)
+        return self.final_restart(self.phases[index - 1], replica) if index > 0 else self.initial_restart
+
+    def phase_sources(self, phase: str, params: Optional[SimulationParameters] = None) -> List[str]:
+        """Return the distinct restart files the replicas of a phase start from"""
+        sources = []
+        for replica in self.replica_ids(phase, params):
+            source = self.phase_source(phase, replica)
+            if source and source not in sources:
+                sources.append(source)
+        return sources
+
+    def is_phase_complete(self, phase: str, params: Optional[SimulationParameters] = None) -> bool:
+        """Check whether the final restarts of a phase (of all replicas) are already present"""
+        return all((self.base_dir / self.final_restart(phase, replica)).exists()
+                   for replica in self.replica_ids(phase, params))
+
+    def pending_phases(self, params: Optional[SimulationParameters] = None) -> List[str]:
+        """Return the phases still to run, from the first phase without its final restart"""
+        for i, phase in enumerate(self.phases):
+            if not self.is_phase_complete(phase, params):
+                return self.phases[i:]
+        return []
+
+    def check_phase_source(self, phase: str, params: Optional[SimulationParameters] = None):
+        """Raise if the restart a phase starts from is missing"""
+        for source in self.phase_sources(phase, params):
+            if not (self.base_dir / source).exists():
+                raise FileNotFoundError(f"Cannot start {phase}: restart of the previous phase {source} is missing")
+
+    def _source_check(self, phase: str, params: Optional[SimulationParameters] = None) -> str:
+        """Generate a shell check that the restarts a phase starts from exist"""
+        sources = self.phase_sources(phase, params)
+        if not sources:
+            return ""
+        if len(sources) == 1:
+            return f"""
+# Check the restart of the previous phase
+if [ ! -f {sources[0]} ]; then
+    echo "Missing restart of the previous phase: {sources[0]}" >&2
+    exit 1
+fi
+"""
+        return f"""
+# Check the restarts of all replicas of the previous phase
+for source in {" ".join(sources)}; do
+    if [ ! -f $source ]; then
+        echo "Missing restart of the previous phase: $source" >&2
+        exit 1
+    fi
+done
+"""
+
+    def segment_ends(self, phase: str, params: SimulationParameters) -> List[int]:
+        """Return the last step of each resumable segment of a phase
+
+        Segment length is max_segment_steps, or the number of steps that fit in
+        segment_time_fraction of time_limit at steps_per_hour. A phase that fits in
+        one job is a single segment when checkpointing is enabled, and a plain
+        (non-resumable) job otherwise, signalled by an empty list. Replicated
+        phases can not be resumed and must fit in one job.
+        """
+        if phase == "minimization":
+            return []
+
+        total = getattr(params, f"{phase}_steps")
+        seg_steps = 0
+        if params.max_segment_steps:
+            seg_steps = params.max_segment_steps
+        elif params.steps_per_hour:
+            hours = parse_slurm_time(params.time_limit) / 3600
+            seg_steps = int(params.steps_per_hour * hours * params.segment_time_fraction)
+            if seg_steps < params.restart_freq:
+                raise ValueError(f"A segment of {phase} fits {seg_steps} steps in the time limit, "
+                                 f"fewer than restart_freq ({params.restart_freq})")
+            seg_steps -= seg_steps % params.restart_freq
+
+        if seg_steps <= 0 or total <= seg_steps:
+            segments = [total] if params.checkpoint_signal_lead else []
+        else:
+            segments = list(range(seg_steps, total, seg_steps)) + [total]
+        if segments and self.is_replicated(phase, params):
+            raise ValueError(f"Replicated phase {phase} can not be segmented or checkpointed")
+        return segments
+
+    def _lammps_command(self, phase: str, params: SimulationParameters, launcher: Optional[str] = None,
+                        extra_vars: Optional[Dict[str, str]] = None, log_file: Optional[str] = None) -> str:
+        """Generate the command line running LAMMPS for a specific phase
+
+        Replicated phases run all replicas in one mpirun with -partition, each
+        replica logging to {phase}/log.lammps.N. Their temperatures are defined
+        in the input as world-style variables.
+        """
+        ntasks = self.phase_ntasks(phase, params)
+        if launcher is None:
+            launcher = f"mpirun -np {ntasks} " if ntasks > 1 else ""
+        if self.is_replicated(phase, params):
+            command = f"""{launcher}lmp -partition {params.replicas}x{params.ntasks} \\
+    -plog {phase}/log.lammps -pscreen none \\
+    -in input_files/{phase}.in \\"""
+        else:
+            command = f"""{launcher}lmp -in input_files/{phase}.in \\
+    -var temperature {params.temperature} \\"""
+        if log_file:
+            command += f"""
+    -log {log_file} \\"""
+        command += f"""
+    -var pressure {params.pressure} \\
+    -var timestep {params.timestep} \\
+    -var is_gpu {1 if params.use_gpu else 0}"""
+        for var, value in (extra_vars or {}).items():
+            command += f""" \\
+    -var {var} {value}"""
+        return command
+
+    def phase_ntasks(self, phase: str, params: SimulationParameters) -> int:
+        """Return the number of MPI tasks of a phase, summed over its replicas"""
+        return params.ntasks * len(self.replica_ids(phase, params))
+
+    def create_submission_script(self, phase: str, params: SimulationParameters,
+                                 segment: Optional[int] = None) -> str:
+        """Create submission script for a specific phase (or one segment of it)"""
+        segments = self.segment_ends(phase, params) if segment is not None else []
+        suffix = f"_seg{segment}" if len(segments) > 1 else ""
+        script_path = self.base_dir / "scripts" / f"submit_{phase}{suffix}.sh"
+
+        resume = ""
+        extra_vars = None
+        if segments:
+            resume = self._generate_resume(phase, params)
+            extra_vars = {
+                "restart_file": "${restart_file:-none}",
+                "run_until": segments[segment]
+            }
+
+        monitored = self.is_monitored(phase, params, bool(segments))
+        run = self._lammps_command(phase, params, extra_vars=extra_vars,
+                                   log_file=f"{phase}/log.lammps" if monitored else None)
+        if monitored:
+            resume += f"""
+rm -f {phase}/CONVERGED
+"""
+            run += f""" &
+lmp_pid=$!
+
+# Tail the log and create {phase}/CONVERGED once {", ".join(params.monitor_properties)} converged
+python -m workflow.lammps.monitor {phase}/log.lammps {phase}/CONVERGED --pid $lmp_pid \\
+    --properties {" ".join(params.monitor_properties)} --init {params.monitor_init} \\
+    --width {params.monitor_width} --interval {params.monitor_interval} &
+monitor_pid=$!
+sleep 5
+if ! kill -0 $monitor_pid 2>/dev/null; then
+    echo "WARNING: thermo monitor exited early, {phase} will run all steps" >&2
+fi
+
+wait $lmp_pid
+exit $?"""
+        if segments and params.checkpoint_signal_lead:
+            resume += f"""
+# Ask LAMMPS to write a restart and stop when Slurm signals the time limit or preemption
+rm -f {phase}/HALT
+trap 'touch {phase}/HALT' USR1
+"""
+            run += f""" &
+lmp_pid=$!
+
+# The trap interrupts wait, so keep waiting until LAMMPS has exited
+wait $lmp_pid
+status=$?
+while kill -0 $lmp_pid 2>/dev/null; do
+    wait $lmp_pid
+    status=$?
+done
+rm -f {phase}/HALT
+"""
+            if params.checkpoint_action == "requeue":
+                run += f"""
+# LAMMPS exits with {CHECKPOINT_EXIT_CODE} after checkpointing an unfinished run
+if [ $status -eq {CHECKPOINT_EXIT_CODE} ]; then
+    scontrol requeue $SLURM_JOB_ID
+fi
+"""
+            run += "exit $status"
         
         content = f"""#!/bin/bash
 # Load required modules
@@ -96,56 +387,476 @@ module load lammps
 
 # Set OpenMP threads
 export OMP_NUM_THREADS={params.cpus_per_task}
-
+{self._source_check(phase, params) if not segment else ""}{resume}
 # Run LAMMPS
-{"mpirun -np " + str(params.ntasks) if params.ntasks > 1 else ""} lmp -in input_files/{phase}.in \\
-    -var temperature {params.temperature} \\
-    -var pressure {params.pressure} \\
-    -var timestep {params.timestep} \\
-    -var is_gpu {1 if params.use_gpu else 0}
+{run}
 """
         
-        with open(script_path, "w") as f:
-            f.write(content)
+        self.write_file(script_path, content)
         
         script_path.chmod(0o755)
         return str(script_path)
 
-    def submit_workflow(self, params: SimulationParameters, name: str) -> None:
-        """Submit complete workflow to Slurm"""
-        phases = ["minimization", "equilibration", "production"]
-        previous_job_id = None
+    def _generate_resume(self, phase: str, params: SimulationParameters) -> str:
+        """Generate the shell lines choosing the restart a segment resumes from
+
+        The newest restart by mtime may have been cut short when the job was killed
+        while writing it. A segment resumes from the last file its input listed in
+        the restart log after it was completely written, or from the older of the
+        two toggling files (the newer one may be the file being overwritten).
+        """
+        log = self.restart_log(phase)
+        resume = f"""
+# Resume from the newest restart of this phase known to be completely written
+restart_file=
+if [ -f {log} ]; then
+    restart_file=$(tac {log} | while read -r file; do
+        if [ -f "$file" ]; then echo "$file"; break; fi
+    done)
+fi
+"""
+        if params.restart_mode == "toggle":
+            prefix = self.file_prefix(phase, params)
+            resume += f"""previous_toggle=$(ls -t {phase}/restart/{prefix}.a.restart {phase}/restart/{prefix}.b.restart 2>/dev/null | sed -n 2p)
+if [ -n "$previous_toggle" ] && {{ [ -z "$restart_file" ] || [ "$previous_toggle" -nt "$restart_file" ]; }}; then
+    restart_file=$previous_toggle
+fi
+"""
+        return resume
+
+    def create_fused_script(self, params: SimulationParameters, phases: Optional[List[str]] = None) -> str:
+        """Create one submission script running all phases in sequence in a single allocation"""
+        script_path = self.base_dir / "scripts" / "submit_fused.sh"
+        phases = phases if phases else self.phases
+
+        content = f"""#!/bin/bash
+# Load required modules
+module purge
+module load lammps
+
+# Set OpenMP threads
+export OMP_NUM_THREADS={params.cpus_per_task}
+{self._source_check(phases[0], params)}
+# Run all phases in one allocation
+"""
+        for phase in phases:
+            content += f"""{self._lammps_command(phase, params)} \\
+    || exit $?
+"""
+
+        self.write_file(script_path, content)
+
+        script_path.chmod(0o755)
+        return str(script_path)
+
+    def create_packed_script(self, name: str, systems: List[Dict], total_cores: int) -> str:
+        """Create a submission script running many systems as job steps of one allocation
+
+        Each system runs its phases in sequence as `srun --exclusive` steps. A new
+        system is only launched when enough cores of the allocation are free.
+        """
+        script_path = self.base_dir / "scripts" / f"submit_pack_{name}.sh"
+        failed_file = f"scripts/pack_{name}.failed"
+
+        content = f"""#!/bin/bash
+# Load required modules
+module purge
+module load lammps
+
+TOTAL_CORES={total_cores}
+free_cores=$TOTAL_CORES
+pids=()
+pid_cores=()
+rm -f {failed_file}
+
+# Return the cores of finished systems to the pool
+reap() {{
+    local i alive_pids=() alive_cores=()
+    for i in "${{!pids[@]}}"; do
+        if kill -0 "${{pids[$i]}}" 2>/dev/null; then
+            alive_pids+=("${{pids[$i]}}")
+            alive_cores+=("${{pid_cores[$i]}}")
+        else
+            free_cores=$((free_cores + pid_cores[$i]))
+        fi
+    done
+    pids=("${{alive_pids[@]}}")
+    pid_cores=("${{alive_cores[@]}}")
+}}
+
+# launch <cores> <function>: wait for free cores, then start the function in background
+launch() {{
+    while [ "$free_cores" -lt "$1" ]; do
+        wait -n
+        reap
+    done
+    "$2" &
+    pids+=($!)
+    pid_cores+=("$1")
+    free_cores=$((free_cores - $1))
+}}
+"""
+        for i, system in enumerate(systems):
+            params = system["params"]
+            launcher = (f"srun --exclusive --nodes=1 --ntasks={params.ntasks} "
+                        f"--cpus-per-task={params.cpus_per_task} ")
+            content += f"""
+run_system_{i}() {{
+    cd {system["name"]} || {{ echo {system["name"]} >> {failed_file}; return 1; }}
+    export OMP_NUM_THREADS={params.cpus_per_task}
+"""
+            for phase in system.get("phases", self.phases):
+                content += f"""    {self._lammps_command(phase, params, launcher)} \\
+        || {{ echo {system["name"]} >> ../{failed_file}; return 1; }}
+"""
+            content += "}\n"
+
+        content += "\n# Run all systems\n"
+        for i, system in enumerate(systems):
+            params = system["params"]
+            content += f"launch {params.ntasks * params.cpus_per_task} run_system_{i}\n"
+        content += f"""wait
+
+if [ -f {failed_file} ]; then
+    echo "Failed systems:"
+    cat {failed_file}
+    exit 1
+fi
+"""
+
+        self.write_file(script_path, content)
+
+        script_path.chmod(0o755)
+        return str(script_path)
+
+    def submit_workflow(self, params: SimulationParameters, name: str,
+                        depends_on: Optional[str] = None) -> Dict[str, str]:
+        """Submit complete workflow to Slurm
+
+        Each phase starts from the final restart of the previous one, and phases
+        whose final restart is already present are skipped. Phases longer than
+        the time limit are split into segments chained with afterok. Each segment
+        resumes from the last restart of its phase and is resubmitted
+        automatically if it hits TIMEOUT. The first job waits for depends_on if
+        given. Returns the ID of the last job of each submitted phase.
+        """
+        phases = self.pending_phases(params)
+        if not phases:
+            logging.info(f"All phases of {name} are complete, nothing to submit")
+            return {}
+        if depends_on is None:
+            self.check_phase_source(phases[0], params)
+        if params.validate_inputs:
+            errors = self.validate(params, phases)
+            if errors:
+                raise Exception(f"Invalid LAMMPS input of {name}: " +
+                                "; ".join(f"{phase}: {' | '.join(e)}" for phase, e in errors.items()))
+
+        if self.should_fuse(params, phases):
+            job_id = self.submit_fused(params, name, phases, depends_on)
+            return {phase: job_id for phase in phases}
+
+        previous_job_id = depends_on
+        job_ids = {}
         
         for phase in phases:
             # Create LAMMPS input script
             lammps_script = self.create_lammps_script(phase, params)
+            segments = self.segment_ends(phase, params)
             
-            # Create submission script
-            submit_script = self.create_submission_script(phase, params)
-            
-            # Prepare Slurm parameters
-            slurm_params = {
-                "partition": params.partition,
-                "nodes": params.nodes,
-                "ntasks": params.ntasks,
-                "cpus_per_task": params.cpus_per_task,
-                "memory": params.memory,
-                "time_limit": params.time_limit
-            }
-            
-            # Add job dependency if not first phase
-            if previous_job_id:
-                slurm_params["depends_on"] = previous_job_id
-            
-            # Submit job
-            job_id = self.slurm_manager.add_job(
-                name=f"{name}_{phase}",
-                script_path=submit_script,
-                working_dir=str(self.base_dir),
-                **slurm_params
-            )
-            
-            previous_job_id = job_id
+            for segment in (range(len(segments)) if segments else [None]):
+                # Create submission script
+                submit_script = self.create_submission_script(phase, params, segment)
+                
+                # Prepare Slurm parameters
+                slurm_params = self._slurm_params(phase, params)
+                job_name = f"{name}_{phase}"
+                if segment is not None:
+                    if len(segments) > 1:
+                        job_name += f"_seg{segment}"
+                    slurm_params["max_resubmits"] = params.max_resubmits
+                    slurm_params["features"]["steps"] = segments[segment] - (segments[segment - 1] if segment else 0)
+                    if params.checkpoint_signal_lead:
+                        slurm_params["signal"] = f"B:USR1@{params.checkpoint_signal_lead}"
+                        slurm_params["requeue"] = params.checkpoint_action == "requeue"
+                
+                # Add job dependency if not first phase
+                if previous_job_id:
+                    slurm_params["depends_on"] = previous_job_id
+                
+                # Submit job
+                job_id = self.slurm_manager.add_job(
+                    name=job_name,
+                    script_path=submit_script,
+                    working_dir=str(self.base_dir),
+                    **slurm_params
+                )
+                
+                previous_job_id = job_id
+            job_ids[phase] = previous_job_id
+
+        return job_ids
+
+    def validate(self, params: SimulationParameters, phases: Optional[List[str]] = None,
+                 cache: Optional[ValidationCache] = None) -> Dict[str, List[str]]:
+        """Dry-run the inputs of phases with lmp -skiprun and return the errors by phase
+
+        The inputs submit_workflow writes are generated in a temporary copy of the
+        layout and dry-run in order, on a single process without GPU, replicas or the
+        equilibration_tolerance loop. -skiprun skips the runs but not write_restart, so
+        each phase reads the restart written by the dry run of the phase before it, or
+        the real restart if it already exists. A segmented phase is checked as its first
+        segment and once more resuming from the restart that segment wrote. A phase
+        whose source restart is neither present nor produced by an earlier dry run is
+        checked from system.data. Results are cached by the hash of the inputs so far.
+        """
+        phases = phases if phases else self.phases
+        cache = cache if cache else ValidationCache()
+        check_params = replace(params, use_gpu=False, replicas=1, equilibration_tolerance=None)
+        system_files = [self.base_dir / f for f in ("system.data", "system.in.settings", "system.in.charges")
+                        if (self.base_dir / f).exists()]
+
+        errors = {}
+        with tempfile.TemporaryDirectory(prefix="lammps_check_") as tmp:
+            check = LammpsWorkflow(base_dir=tmp, slurm_manager=self.slurm_manager,
+                                   initial_restart=self.initial_restart)
+            check.phases = list(self.phases)
+            self.link_system_files(check)
+            for source in self.phase_sources(phases[0], check_params):
+                if not (self.base_dir / source).exists() or source.startswith(".."):
+                    check.phases = check.phases[check.phases.index(phases[0]):]
+                    check.initial_restart = None
+                    break
+                if not Path(source).is_absolute():
+                    (check.base_dir / source).symlink_to((self.base_dir / source).resolve())
+                system_files.append(self.base_dir / source)
+
+            # Inputs and command lines of all phases, each segmented phase with its first and a resumed segment
+            runs = []
+            for phase in phases:
+                content = Path(check.create_lammps_script(phase, check_params)).read_text()
+                segments = check.segment_ends(phase, check_params)
+                if not segments:
+                    runs.append((phase, content, check._lammps_command(phase, check_params, launcher=""), None))
+                    continue
+                for restart_file in ("none", "$resume"):
+                    command = check._lammps_command(phase, check_params, launcher="",
+                                                    extra_vars={"restart_file": restart_file, "run_until": segments[0]})
+                    runs.append((phase, content, command, restart_file))
+
+            digest = hashlib.sha256()
+            keys = []
+            for phase, content, command, _ in runs:
+                digest.update(content.encode())
+                digest.update(command.encode())
+                keys.append(validation_key(digest.hexdigest(), system_files, command))
+            cached = [cache.get(key) for key in keys]
+
+            for (phase, _, command, restart_file), key, run_errors in zip(runs, keys, cached):
+                if None in cached:
+                    if restart_file == "$resume":
+                        restart_log = check.base_dir / check.restart_log(phase)
+                        if not restart_log.exists():
+                            continue
+                        resume = restart_log.read_text().split()[-1]
+                        command = command.replace("-var restart_file $resume", f"-var restart_file {resume}")
+                    run_errors = skiprun(command, tmp, exit_codes=(0, CHECKPOINT_EXIT_CODE))
+                    cache.set(key, run_errors)
+                    restart_log = check.base_dir / check.restart_log(phase)
+                    final = check.base_dir / check.final_restart(phase)
+                    if restart_file and restart_log.exists() and not final.exists():
+                        # Only the last segment writes the final restart the next phase reads
+                        shutil.copy(check.base_dir / restart_log.read_text().split()[-1], final)
+                if run_errors:
+                    logging.error(f"Dry run of {phase} input failed: {' | '.join(run_errors)}")
+                    phase_errors = errors.setdefault(phase, [])
+                    phase_errors.extend(e for e in run_errors if e not in phase_errors)
+        return errors
+
+    def estimate_runtime(self, phase: str, params: SimulationParameters) -> Optional[float]:
+        """Estimate the run time of a phase in seconds from accounting history or steps_per_hour"""
+        prediction = self.slurm_manager.predict_resources(self._features(phase, params), margin=1.0)
+        if prediction:
+            return parse_slurm_time(prediction[0])
+        if params.steps_per_hour:
+            return getattr(params, f"{phase}_steps") / params.steps_per_hour * 3600
+        return None
+
+    def should_fuse(self, params: SimulationParameters, phases: Optional[List[str]] = None) -> bool:
+        """Decide whether all phases run as one job
+
+        Resumable (segmented or checkpointed) phases always get their own jobs.
+        Otherwise phases are fused when requested, or automatically when the
+        summed runtime estimate with resource_margin fits the partition limit.
+        """
+        phases = phases if phases else self.phases
+        if params.fuse_phases is False:
+            return False
+        if any(self.segment_ends(phase, params) for phase in phases):
+            return False
+        if params.fuse_phases:
+            return True
+
+        estimates = [self.estimate_runtime(phase, params) for phase in phases]
+        if None in estimates:
+            return False
+        limit = parse_slurm_time(params.partition_time_limit or params.time_limit)
+        return sum(estimates) * params.resource_margin <= limit
+
+    def submit_fused(self, params: SimulationParameters, name: str, phases: Optional[List[str]] = None,
+                     depends_on: Optional[str] = None) -> str:
+        """Submit all (or the given) phases as a single job"""
+        phases = phases if phases else self.phases
+        # The fused script does not start the thermo monitor
+        params = replace(params, monitor_properties=None)
+        for phase in phases:
+            self.create_lammps_script(phase, params)
+        submit_script = self.create_fused_script(params, phases)
+
+        slurm_params = self._slurm_params(phases[-1], params)
+        slurm_params["features"] = {
+            **slurm_params["features"],
+            "phase": "fused",
+            "steps": sum(getattr(params, f"{phase}_steps") for phase in phases),
+        }
+        estimates = [self.estimate_runtime(phase, params) for phase in phases]
+        if None not in estimates:
+            limit = parse_slurm_time(params.partition_time_limit or params.time_limit)
+            slurm_params["time_limit"] = format_slurm_time(min(limit, sum(estimates) * params.resource_margin))
+        if depends_on:
+            slurm_params["depends_on"] = depends_on
+
+        return self.slurm_manager.add_job(
+            name=f"{name}_fused",
+            script_path=submit_script,
+            working_dir=str(self.base_dir),
+            **slurm_params
+        )
+
+    def _features(self, phase: str, params: SimulationParameters) -> Dict:
+        """Describe a phase for matching against accounting history"""
+        return {
+            "phase": phase,
+            "atoms": params.n_atoms,
+            "steps": getattr(params, f"{phase}_steps"),
+            "ntasks": self.phase_ntasks(phase, params),
+            "nodes": params.nodes,
+        }
+
+    def _slurm_params(self, phase: str, params: SimulationParameters) -> Dict:
+        """Prepare Slurm parameters of a phase, using predicted resources if requested"""
+        features = self._features(phase, params)
+        slurm_params = {
+            "partition": params.partition,
+            "nodes": params.nodes,
+            "ntasks": self.phase_ntasks(phase, params),
+            "cpus_per_task": params.cpus_per_task,
+            "memory": params.memory,
+            "time_limit": params.time_limit,
+            "features": features
+        }
+
+        if params.auto_resources:
+            prediction = self.slurm_manager.predict_resources(features, margin=params.resource_margin)
+            if prediction:
+                slurm_params["time_limit"], slurm_params["memory"] = prediction
+
+        return slurm_params
+
+    def submit_sweep(self, params: SimulationParameters, temperatures: List[float], name: str,
+                     warm_equilibration_steps: Optional[int] = None) -> Dict[float, Dict[str, str]]:
+        """Submit a temperature ladder where each state point warm-starts from its neighbour
+
+        Every temperature gets a sub-directory T<temperature> of base_dir linked to the
+        system files of base_dir. The first temperature runs the full workflow. Each
+        further one skips minimization and starts from the final equilibration restart
+        of the previous temperature, with at most warm_equilibration_steps of
+        equilibration (stopping earlier when equilibration_tolerance is set), and its
+        equilibration waits for the previous one with afterok. Returns the job IDs of
+        each temperature.
+        """
+        if params.replicas > 1:
+            raise ValueError("Temperature sweeps do not support replicas")
+
+        job_ids = {}
+        previous = None
+        for temperature in temperatures:
+            point_dir = f"T{temperature:g}"
+            if previous is None:
+                workflow = LammpsWorkflow(base_dir=str(self.base_dir / point_dir), slurm_manager=self.slurm_manager)
+                point_params = replace(params, temperature=temperature)
+                depends_on = None
+            else:
+                workflow = LammpsWorkflow(base_dir=str(self.base_dir / point_dir), slurm_manager=self.slurm_manager,
+                                          initial_restart=f"../T{previous:g}/{self.final_restart('equilibration')}")
+                workflow.phases = ["equilibration", "production"]
+                point_params = replace(params, temperature=temperature,
+                                       equilibration_steps=warm_equilibration_steps or params.equilibration_steps)
+                depends_on = job_ids[previous].get("equilibration")
+            self.link_system_files(workflow)
+
+            job_ids[temperature] = workflow.submit_workflow(point_params, f"{name}_{point_dir}", depends_on)
+            previous = temperature
+
+        return job_ids
+
+    def link_system_files(self, workflow: "LammpsWorkflow"):
+        """Link the system data and settings of base_dir into the directory of another workflow"""
+        for file_name in ("system.data", "system.in.settings", "system.in.charges"):
+            source = self.base_dir / file_name
+            target = workflow.base_dir / file_name
+            if source.exists() and not target.exists():
+                os.symlink(os.path.relpath(source, workflow.base_dir), target)
+
+    def submit_packed(self, systems: List[Dict], name: str, nodes: int = 1, cores_per_node: int = 64,
+                      partition: Optional[str] = None, memory: str = "0", time_limit: Optional[str] = None,
+                      **slurm_params) -> Optional[str]:
+        """Submit many small systems as job steps of a single Slurm allocation
+
+        Each entry of systems is a dict with "name" and "params" (SimulationParameters).
+        Every system gets its own sub-directory of base_dir with the usual layout, so
+        queue wait is paid once for the whole pack.
+        """
+        total_cores = nodes * cores_per_node
+        pending = []
+        for system in systems:
+            params = system["params"]
+            if params.ntasks * params.cpus_per_task > cores_per_node:
+                raise ValueError(f"System {system['name']} needs more cores than a single node provides")
+            if params.replicas > 1:
+                raise ValueError(f"System {system['name']} has replicas, which can not be packed")
+
+            workflow = LammpsWorkflow(base_dir=str(self.base_dir / system["name"]),
+                                      slurm_manager=self.slurm_manager)
+            phases = workflow.pending_phases()
+            if not phases:
+                logging.info(f"All phases of {system['name']} are complete, skipping")
+                continue
+            workflow.check_phase_source(phases[0])
+            # The packed script does not start the thermo monitor
+            params = replace(params, monitor_properties=None)
+            for phase in phases:
+                workflow.create_lammps_script(phase, params, allow_segments=False)
+            pending.append({**system, "params": params, "phases": phases})
+
+        if not pending:
+            return None
+        systems = pending
+        submit_script = self.create_packed_script(name, systems, total_cores)
+        first = systems[0]["params"]
+
+        return self.slurm_manager.add_job(
+            name=f"{name}_pack",
+            script_path=submit_script,
+            working_dir=str(self.base_dir),
+            partition=partition if partition else first.partition,
+            nodes=nodes,
+            ntasks=total_cores,
+            cpus_per_task=1,
+            memory=memory,
+            time_limit=time_limit if time_limit else first.time_limit,
+            **slurm_params
+        )
 
     def _generate_header(self, params: SimulationParameters) -> str:
         """Generate LAMMPS header section"""
@@ -166,8 +877,47 @@ suffix          {params.gpu_suffix}
 """
         return header
     
-    def _generate_system_setup(self) -> str:
-        """Generate system setup section"""
+    def _generate_replicas(self, params: SimulationParameters) -> str:
+        """Generate world-style variables holding the settings of each replica"""
+        temperatures = params.replica_temperatures or [params.temperature] * params.replicas
+        seeds = params.replica_seeds or [params.velocity_seed + i for i in range(params.replicas)]
+        if len(temperatures) != params.replicas or len(seeds) != params.replicas:
+            raise ValueError(f"replica_temperatures and replica_seeds need {params.replicas} values")
+        return f"""# Replica settings, one value per partition
+variable        replica world {" ".join(str(i) for i in range(params.replicas))}
+variable        temperature world {" ".join(str(t) for t in temperatures)}
+variable        seed world {" ".join(str(seed) for seed in seeds)}
+
+"""
+
+    def restart_log(self, phase: str) -> str:
+        """Return the file listing completely written restarts of a resumable phase"""
+        return f"{phase}/restart/{self.phase_prefix[phase]}.restarts"
+
+    def _generate_resumable_setup(self, phase: str) -> str:
+        """Generate system setup that continues from restart_file when it is not "none" """
+        return f"""# Start from the last restart of this phase if one exists
+if "${{restart_file}} != none" then "jump SELF continue_run"
+
+{self._generate_system_setup(self.phase_source(phase))}reset_timestep  0
+jump            SELF setup_done
+
+label           continue_run
+read_restart    ${{restart_file}}
+include         "system.in.settings"
+print           "${{restart_file}}" append {self.restart_log(phase)} screen no
+label           setup_done
+
+"""
+
+    def _generate_system_setup(self, source: Optional[str] = None) -> str:
+        """Generate system setup section, reading the restart of the previous phase if given"""
+        if source:
+            return f"""# Continue from the previous phase
+read_restart    {source}
+include         "system.in.settings"
+
+"""
         return """# Read system data
 read_data       system.data
 include         "system.in.settings"
@@ -205,56 +955,177 @@ write_restart   minimization/min.restart
 
 """
     
-    def _generate_equilibration(self, params: SimulationParameters) -> str:
+    def _generate_equilibration(self, params: SimulationParameters, segmented: bool = False) -> str:
         """Generate equilibration section"""
-        return f"""# Equilibration
+        return self._generate_md("equilibration", params, params.equilibration_steps, segmented)
+    
+    def _generate_production(self, params: SimulationParameters, segmented: bool = False) -> str:
+        """Generate production section"""
+        return self._generate_md("production", params, params.production_steps, segmented)
+
+    def _generate_md(self, phase: str, params: SimulationParameters, steps: int, segmented: bool) -> str:
+        """Generate NPT MD section shared by equilibration and production
+
+        Segmented runs advance to run_until with `run ... upto`, so a resubmitted
+        segment only runs the steps that are still missing.
+        """
+        prefix = self.file_prefix(phase, params)
+        title = phase.capitalize()
+        temperature = "${temperature}" if self.is_replicated(phase, params) else params.temperature
+        if segmented:
+            start = f"# {title}\n"
+            log = self.restart_log(phase)
+            if params.restart_mode == "series":
+                start += f"""
+# List each periodic restart once the next one is due, i.e. after it was completely written
+fix             restart_log all print {params.restart_freq} "{phase}/restart/{prefix}.$(step-{params.restart_freq}).restart" append {log} screen no
+"""
+            run = f"""run             ${{run_until}} upto{self._restart_keep(phase, params)}
+
+write_restart   {phase}/restart/{self._segment_restart(phase, params)}
+print           "{phase}/restart/{self._segment_restart(phase, params)}" append {log} screen no
+if "$(step) >= {steps}" then "write_restart {phase}/{prefix}.final.restart"
+"""
+            if params.checkpoint_signal_lead:
+                start += f"""
+# Stop cleanly when the job script receives the checkpoint signal
+variable        halt equal is_file({phase}/HALT)
+fix             halt all halt {params.checkpoint_check_freq} v_halt > 0 error soft
+"""
+                if params.checkpoint_timer:
+                    timeout = parse_slurm_time(params.time_limit) - params.checkpoint_signal_lead
+                    start += f"timer           timeout {format_slurm_time(timeout)} every {params.checkpoint_check_freq}\n"
+                run += f"""if "$(step) < ${{run_until}}" then "quit {CHECKPOINT_EXIT_CODE}"
+"""
+        else:
+            start = f"""# {title}
 reset_timestep  0
+"""
+            run = f"""run            {steps}{self._restart_keep(phase, params)}
 
+write_restart  {phase}/{prefix}.final.restart
+"""
+            if self.is_monitored(phase, params, segmented):
+                start += f"""
+# Stop cleanly once the thermo monitor reports convergence
+variable        converged equal is_file({phase}/CONVERGED)
+fix             converged all halt {params.monitor_check_freq} v_converged > 0 error soft
+"""
+            if phase == "equilibration" and params.equilibration_tolerance:
+                run = self._generate_convergence_loop(phase, params, steps) + f"""
+write_restart  {phase}/{prefix}.final.restart
+"""
+        if self.is_replicated(phase, params) and phase == "equilibration":
+            start += """
+# Replica-specific initial velocities
+velocity        all create ${temperature} ${seed} dist gaussian mom yes rot yes
+"""
+        return f"""{start}
 # Temperature and pressure control
 fix             1 all momentum 1000 linear 1 1 1 angular
-fix             2 all npt temp {params.temperature} {params.temperature} 100.0 iso {params.pressure} {params.pressure} 1000.0
+fix             2 all npt temp {temperature} {temperature} 100.0 iso {params.pressure} {params.pressure} 1000.0
 
 # Output settings
 thermo          {params.thermo_freq}
 thermo_style    custom step temp press pe ke etotal ebond eangle epair lx ly lz vol density
 
-dump            1 all custom {params.dump_freq} equilibration/trajectory/equ.*.lammpstrj id type x y z vx vy vz
-dump_modify     1 sort id
-
-restart         {params.restart_freq} equilibration/restart/equ.*.restart
+{self._generate_dump(phase, params, segmented)}
+{self._generate_restart(phase, params)}
 
-# Run equilibration
+# Run {phase}
 timestep        {params.timestep}
-run            {params.equilibration_steps}
+{run}
+"""
 
-write_restart  equilibration/equ.final.restart
+    def is_monitored(self, phase: str, params: SimulationParameters, segmented: bool = False) -> bool:
+        """Check whether a phase stops early on converged thermo output
 
+        Only a plain equilibration job is monitored: the monitor tails one log of a
+        single run, so segmented, replicated (per-partition logs) and block-loop
+        (equilibration_tolerance) runs are not. Fused and packed jobs do not start
+        the monitor and generate their inputs without monitor_properties.
+        """
+        return (phase == "equilibration" and bool(params.monitor_properties) and not segmented
+                and not self.is_replicated(phase, params) and not params.equilibration_tolerance)
+
+    def _generate_convergence_loop(self, phase: str, params: SimulationParameters, steps: int) -> str:
+        """Generate an equilibration run in blocks that stops when the density has converged
+
+        The run stops once the block-averaged density changes by less than
+        equilibration_tolerance between two blocks, or after steps.
+        """
+        block = params.equilibration_block
+        # fix ave/time needs Nevery * Nrepeat == Nfreq, so sample every 10 steps or a divisor of block
+        every = max(n for n in range(1, 11) if block % n == 0)
+        return f"""variable        rho equal density
+fix             rho_avg all ave/time {every} {block // every} {block} v_rho
+variable        rho_last equal 0.0
+variable        block loop {math.ceil(steps / block)}
+label           converge
+run             {block}{self._restart_keep(phase, params)}
+variable        rho_now equal $(f_rho_avg)
+variable        drho equal abs(v_rho_now-v_rho_last)/v_rho_now
+print           "Block ${{block}}: density ${{rho_now}}, relative change ${{drho}}"
+if "${{drho}} < {params.equilibration_tolerance}" then "jump SELF converged"
+variable        rho_last equal ${{rho_now}}
+next            block
+jump            SELF converge
+label           converged
+unfix           rho_avg
 """
-    
-    def _generate_production(self, params: SimulationParameters) -> str:
-        """Generate production section"""
-        return f"""# Production
-reset_timestep  0
 
-# Temperature and pressure control
-fix             1 all momentum 1000 linear 1 1 1 angular
-fix             2 all npt temp {params.temperature} {params.temperature} 100.0 iso {params.pressure} {params.pressure} 1000.0
+    def _generate_restart(self, phase: str, params: SimulationParameters) -> str:
+        """Generate periodic restart output
 
-# Output settings
-thermo          {params.thermo_freq}
-thermo_style    custom step temp press pe ke etotal ebond eangle epair lx ly lz vol density
+        Toggle mode alternates between two files, so disk use stays constant
+        however long the run is, and one file is always complete.
+        """
+        prefix = self.file_prefix(phase, params)
+        if params.restart_mode == "series":
+            return f"restart         {params.restart_freq} {phase}/restart/{prefix}.*.restart"
+        elif params.restart_mode == "toggle":
+            return (f"restart         {params.restart_freq} "
+                    f"{phase}/restart/{prefix}.a.restart {phase}/restart/{prefix}.b.restart")
+        raise ValueError(f"Unknown restart_mode {params.restart_mode}")
 
-dump            1 all custom {params.dump_freq} production/trajectory/prod.*.lammpstrj id type x y z vx vy vz
-dump_modify     1 sort id
+    def _segment_restart(self, phase: str, params: SimulationParameters) -> str:
+        """Return the restart file name written at the end of a segment"""
+        prefix = self.file_prefix(phase, params)
+        return f"{prefix}.$(step).restart" if params.restart_mode == "series" else f"{prefix}.last.restart"
 
-restart         {params.restart_freq} production/restart/prod.*.restart
+    def _restart_keep(self, phase: str, params: SimulationParameters) -> str:
+        """Generate the run keyword keeping every k-th snapshot next to toggling restarts"""
+        if params.restart_mode != "toggle" or not params.restart_keep_every:
+            return ""
+        every = params.restart_freq * params.restart_keep_every
+        return f' every {every} "write_restart {phase}/restart/{self.file_prefix(phase, params)}.*.restart"'
 
-# Run production
-timestep        {params.timestep}
-run            {params.production_steps}
+    def _generate_dump(self, phase: str, params: SimulationParameters, segmented: bool) -> str:
+        """Generate trajectory output for the selected dump mode
+
+        Except for per_frame, each run writes a single file. A resumable run names
+        it after its first step, so a continuation never overwrites earlier frames.
+        """
+        prefix = self.file_prefix(phase, params)
+        if params.dump_mode not in self.dump_styles:
+            raise ValueError(f"Unknown dump_mode {params.dump_mode}")
+        style, ext = self.dump_styles[params.dump_mode]
 
-write_restart  production/prod.final.restart
+        if params.dump_mode == "per_frame":
+            file_name = f"{prefix}.*.{ext}"
+        elif segmented:
+            file_name = f"{prefix}.$(step).{ext}"
+        else:
+            file_name = f"{prefix}.{ext}"
+        path = f"{phase}/trajectory/{file_name}"
 
+        if style in ("xtc", "dcd"):
+            return f"""dump            1 all {style} {params.dump_freq} {path}
+dump_modify     1 unwrap yes
+"""
+        columns = (params.dump_columns or {}).get(phase, self.dump_columns)
+        return f"""dump            1 all {style} {params.dump_freq} {path} {columns}
+dump_modify     1 sort id
 """
 
     def run_all(self):
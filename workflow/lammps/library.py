@@ -0,0 +1,99 @@
+# ******************************************************************************
+# sim.lammps.library module
+# ******************************************************************************
+
+import os
+import multiprocessing
+import numpy as np
+
+
+def extract_state(lmp):
+    """
+    extract_state
+
+    Read unwrapped coordinates, velocities and cell from a LAMMPS library instance
+
+    Args:
+        lmp: lammps.lammps object
+
+    Return:
+        Unwrapped atomic coordinates sorted by atom ID (numpy.ndarray)
+        Atomic velocities sorted by atom ID (numpy.ndarray)
+        Cell lengths [[xlo, xhi], [ylo, yhi], [zlo, zhi]] (numpy.ndarray)
+    """
+
+    nlocal = lmp.extract_global('nlocal')
+    ids = np.asarray(lmp.numpy.extract_atom('id'))[:nlocal]
+    x = np.asarray(lmp.numpy.extract_atom('x'))[:nlocal]
+    v = np.asarray(lmp.numpy.extract_atom('v'))[:nlocal]
+    image = np.asarray(lmp.numpy.extract_atom('image'))[:nlocal].astype(np.int64)
+    boxlo, boxhi, xy, yz, xz, _, _ = lmp.extract_box()
+
+    # Image flags are packed into 10 bits per dimension
+    ix = (image & 1023) - 512
+    iy = (image >> 10 & 1023) - 512
+    iz = (image >> 20) - 512
+    lx, ly, lz = np.asarray(boxhi) - np.asarray(boxlo)
+
+    order = np.argsort(ids)
+    coord = np.empty((nlocal, 3))
+    coord[:, 0] = x[:, 0] + ix * lx + iy * xy + iz * xz
+    coord[:, 1] = x[:, 1] + iy * ly + iz * yz
+    coord[:, 2] = x[:, 2] + iz * lz
+    cell = np.array([[boxlo[0], boxhi[0]], [boxlo[1], boxhi[1]], [boxlo[2], boxhi[2]]], dtype=float)
+
+    return coord[order], np.array(v[order]), cell
+
+
+def _run_worker(lammps_lib, cmdargs, input_file, work_dir, conn):
+    # Runs in the worker process, whose working directory can be changed freely
+    try:
+        os.chdir(work_dir)
+        lmp = lammps_lib(cmdargs=cmdargs)
+        try:
+            lmp.file(input_file)
+            conn.send(('ok', extract_state(lmp)))
+        finally:
+            lmp.close()
+    except Exception as e:
+        conn.send(('error', '%s: %s' % (type(e).__name__, e)))
+    finally:
+        conn.close()
+
+
+def run_file(lammps_lib, input_file, work_dir, cmdargs):
+    """
+    run_file
+
+    Run an input file with the LAMMPS library in a worker process started in work_dir.
+    LAMMPS resolves relative paths of the input (read_data, log, dump, write_*) against
+    the process working directory, which is changed in the worker only, so threads of
+    the calling process are not affected. The final state is sent back through a pipe.
+
+    Args:
+        lammps_lib: LAMMPS library constructor (lammps.lammps or a picklable replacement)
+        input_file: Input file path relative to work_dir (str)
+        work_dir: Working directory of the run (str)
+        cmdargs: Command line arguments of the library instance (list)
+
+    Return:
+        Unwrapped atomic coordinates, velocities and cell (see extract_state)
+    """
+
+    ctx = multiprocessing.get_context('spawn')
+    recv_conn, send_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_worker, args=(lammps_lib, cmdargs, input_file, os.path.abspath(work_dir), send_conn))
+    proc.start()
+    send_conn.close()
+    try:
+        status, result = recv_conn.recv()
+    except EOFError:
+        status, result = 'error', None
+    finally:
+        recv_conn.close()
+        proc.join()
+
+    if status != 'ok':
+        raise RuntimeError(result if result else 'LAMMPS worker process exited with code %s' % proc.exitcode)
+
+    return result
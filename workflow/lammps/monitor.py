@@ -0,0 +1,161 @@
+import argparse
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+import pandas as pd
+
+# kcal/mol -> kJ/mol
+CAL2J = 4.184
+
+class ThermoMonitor:
+    """Tail a running LAMMPS log and request a clean stop once thermo properties converge
+
+    New thermo rows are read incrementally and checked with the criteria of
+    Analyze.check_eq: the SD of the simple moving average over the last width
+    rows is compared with {property}_sma_sd_crit. When every monitored property
+    has converged, the flag file is created; an input with `fix halt ... v_flag > 0
+    error soft` on is_file(flag) then stops the run and continues with the commands
+    after it, so the final restart is still written. The module only needs pandas,
+    so it runs next to LAMMPS in a job script.
+    """
+    # Analyze property: (thermo column, conversion factor, criterion relative to |mean|, default criterion)
+    properties = {
+        "totene": ("TotEng", CAL2J, True, 0.0005),
+        "kinene": ("KinEng", CAL2J, True, 0.0005),
+        "ebond": ("E_bond", CAL2J, True, 0.001),
+        "eangle": ("E_angle", CAL2J, True, 0.001),
+        "edihed": ("E_dihed", CAL2J, True, 0.002),
+        "evdw": ("E_vdwl", CAL2J, False, 30.0),
+        "ecoul": ("E_coul", CAL2J, False, None),
+        "elong": ("E_long", CAL2J, True, 0.001),
+        "dens": ("Density", 1.0, True, 0.001),
+    }
+
+    def __init__(self, log_file: str, flag_file: str, props: Optional[List[str]] = None,
+                 init: int = 100, width: int = 100, **crit):
+        self.log_file = Path(log_file)
+        self.flag_file = Path(flag_file)
+        self.props = props if props else ["totene", "dens"]
+        self.init = init
+        self.width = width
+        self.crit = crit
+        self.converged = False
+
+        self.offset = 0
+        self.buffer = ""
+        self.in_thermo = False
+        self.columns = []
+        self.rows = []
+
+        for name in self.props:
+            if name not in self.properties:
+                raise ValueError(f"Unknown property {name}, choose from {', '.join(self.properties)}")
+
+    def read_new_lines(self) -> List[str]:
+        """Return complete lines appended to the log since the last call"""
+        if not self.log_file.exists():
+            return []
+        with open(self.log_file, "r") as f:
+            f.seek(self.offset)
+            text = f.read()
+            self.offset = f.tell()
+        text = self.buffer + text
+        lines = text.split("\n")
+        self.buffer = lines.pop()
+        return lines
+
+    def update(self) -> int:
+        """Parse new thermo rows of the current run, returning the number of rows added"""
+        added = 0
+        for line in self.read_new_lines():
+            line = line.rstrip("\r")
+            if line.startswith("Per MPI rank memory allocation") or line.startswith("Memory usage per processor"):
+                # A new run starts a new thermo block
+                self.in_thermo = True
+                self.columns = []
+                self.rows = []
+            elif self.in_thermo and not self.columns:
+                self.columns = line.split()
+            elif self.in_thermo and (line.startswith("Loop time of") or line.startswith("ERROR") or line == ""):
+                self.in_thermo = False
+            elif self.in_thermo:
+                try:
+                    self.rows.append([float(v) for v in line.split()])
+                    added += 1
+                except ValueError:
+                    continue
+        return added
+
+    def check(self) -> bool:
+        """Read new thermo rows and create the flag file if all properties have converged"""
+        if self.converged:
+            return True
+        self.update()
+        if len(self.rows) <= self.init + self.width:
+            return False
+
+        df = pd.DataFrame(self.rows, columns=self.columns)
+        for name in self.props:
+            column, conv, relative, default = self.properties[name]
+            crit = self.crit.get(f"{name}_sma_sd_crit", default)
+            if crit is None:
+                continue
+            if column not in df.columns:
+                logging.warning(f"Thermo column {column} of {name} is not in {self.log_file}")
+                return False
+            mean, sma_sd = self.moving_average_sd(df[column] * conv)
+            if sma_sd > (abs(mean) * crit if relative else crit):
+                return False
+
+        self.converged = True
+        self.flag_file.touch()
+        logging.info(f"{', '.join(self.props)} converged after {len(self.rows)} thermo rows, "
+                     f"created {self.flag_file}")
+        return True
+
+    def moving_average_sd(self, data: pd.Series):
+        """Return the last simple moving average and its SD over the last width rows (as Analyze.analyze_thermo)"""
+        sma = data.rolling(self.width).mean().values
+        return sma[-1], sma[-self.width - 1:].std()
+
+    def watch(self, alive: Optional[Callable[[], bool]] = None, interval: float = 10.0) -> bool:
+        """Check periodically while alive() is true (or until convergence without it)"""
+        while not self.check():
+            if alive is not None and not alive():
+                self.check()
+                break
+            time.sleep(interval)
+        return self.converged
+
+    def watch_process(self, proc, interval: float = 10.0) -> bool:
+        """Check periodically while a LAMMPSProcess started with LAMMPS.exec(wait=False) runs"""
+        return self.watch(lambda: not proc.done(), interval)
+
+def pid_alive(pid: int) -> bool:
+    """Check whether a process is still running"""
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def main(argv: Optional[List[str]] = None):
+    """Command line entry used by generated job scripts"""
+    parser = argparse.ArgumentParser(description="Stop a LAMMPS run once thermo properties converge")
+    parser.add_argument("log_file")
+    parser.add_argument("flag_file")
+    parser.add_argument("--pid", type=int, help="stop monitoring when this process exits")
+    parser.add_argument("--properties", nargs="+", default=None)
+    parser.add_argument("--init", type=int, default=100)
+    parser.add_argument("--width", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    monitor = ThermoMonitor(args.log_file, args.flag_file, args.properties, init=args.init, width=args.width)
+    monitor.watch((lambda: pid_alive(args.pid)) if args.pid else None, args.interval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+# ******************************************************************************
+# sim.lammps.store module
+# ******************************************************************************
+
+import json
+import os
+import shutil
+import numpy as np
+from .dump import traj_file_list, iter_dump
+
+h5py_avail = True
+try:
+    import h5py
+except ImportError:
+    h5py_avail = False
+
+mdtraj_avail = True
+try:
+    import mdtraj
+except ImportError:
+    mdtraj_avail = False
+
+MANIFEST = 'manifest.json'
+FORMAT = 'trajstore'
+# Time units of stored frames: LAMMPS dumps hold integer timesteps, xtc files the time in ps
+TIME_UNITS = {'dump': 'step', 'xtc': 'ps'}
+
+
+def box_vectors(box):
+    """
+    box_vectors
+
+    Convert LAMMPS dump box bounds into cell vectors
+
+    Args:
+        box: 3x2 (orthogonal) or 3x3 (triclinic, with xy xz yz tilts) bounds array
+
+    Return:
+        3x3 array of cell vectors (rows)
+    """
+    box = np.asarray(box, dtype=float)
+    if box.shape[1] == 2:
+        return np.diag(box[:, 1] - box[:, 0])
+
+    xy, xz, yz = box[:, 2]
+    xlo = box[0, 0] - min(0.0, xy, xz, xy + xz)
+    xhi = box[0, 1] - max(0.0, xy, xz, xy + xz)
+    ylo = box[1, 0] - min(0.0, yz)
+    yhi = box[1, 1] - max(0.0, yz)
+    return np.array([
+        [xhi - xlo, 0.0, 0.0],
+        [xy, yhi - ylo, 0.0],
+        [xz, yz, box[2, 1] - box[2, 0]],
+    ])
+
+
+def is_store(path):
+    """
+    is_store
+
+    Check whether a path is a trajectory store written by convert_traj
+    """
+    path = str(path)
+    if os.path.isfile(os.path.join(path, MANIFEST)):
+        return True
+    if path.endswith(('.h5', '.hdf5')) and os.path.isfile(path) and h5py_avail:
+        with h5py.File(path, 'r') as f:
+            return f.attrs.get('format') == FORMAT
+    return False
+
+
+def source_time_unit(files):
+    """
+    source_time_unit
+
+    Time unit of frames read from dumps (step) or xtc files (ps)
+
+    Args:
+        files: List of source files
+
+    Return:
+        'step' or 'ps' (str)
+    """
+    units = set(TIME_UNITS['xtc' if str(name).endswith('.xtc') else 'dump'] for name in files)
+    if len(units) > 1:
+        raise ValueError('Dumps (timesteps) and xtc files (ps) can not be stored together')
+    return units.pop() if units else TIME_UNITS['dump']
+
+
+def _iter_source(traj_file, columns, dtype, top, chunk_frames):
+    # Yield (columns, time, cell vectors, atoms x columns array) from dumps or xtc files
+    files = traj_file_list(traj_file)
+    for name in files:
+        if name.endswith('.xtc'):
+            if not mdtraj_avail:
+                raise ImportError('mdtraj is required to convert %s. You can install it by "conda install -c conda-forge mdtraj"' % name)
+            if columns not in (None, ['x', 'y', 'z']):
+                raise ValueError('xtc files only have x, y and z columns')
+            for chunk in mdtraj.iterload(name, top=top, chunk=chunk_frames):
+                # nm -> angstrom
+                for xyz, cell, t in zip(chunk.xyz, chunk.unitcell_vectors, chunk.time):
+                    yield ['x', 'y', 'z'], t, cell * 10.0, (xyz * 10.0).astype(dtype)
+        else:
+            for frame in iter_dump(name, columns, dtype):
+                yield frame['columns'], frame['timestep'], box_vectors(frame['box']), frame['data']
+
+
+def convert_traj(traj_file, store_path, columns=None, dtype=np.float32, compress=False, chunk_frames=100, top=None):
+    """
+    convert_traj
+
+    Convert LAMMPS text dumps or xtc files into a columnar trajectory store for repeated analysis.
+    Frames are streamed from the source and written in chunks of chunk_frames frames,
+    one array per column with shape (frames, atoms). Times and cell vectors of all
+    frames are stored as metadata; times are timesteps for dumps and ps for xtc files,
+    and the unit is recorded as time_unit. The store is
+        a directory of .npy chunks (memory-mapped on read) with a JSON manifest, or
+        an HDF5 file if store_path ends with .h5 or .hdf5 (requires h5py)
+
+    Args:
+        traj_file: Path, glob pattern or list of dump (may be compressed) or xtc files
+        store_path: Path of the store
+
+    Optional args:
+        columns: Columns of dumps to store (all if None); xtc files have x, y and z in angstrom
+        dtype: dtype of the stored columns (float32 halves the size)
+        compress: Compress chunks (np.savez_compressed chunks, or gzip in HDF5);
+                  compressed npy chunks are decompressed instead of memory-mapped
+        chunk_frames: Number of frames per chunk
+        top: Topology file needed to read xtc files
+
+    Return:
+        TrajStore
+    """
+    store_path = str(store_path)
+    hdf5 = store_path.endswith(('.h5', '.hdf5'))
+    if hdf5 and not h5py_avail:
+        raise ImportError('h5py is required to write %s. You can install it by "pip install h5py"' % store_path)
+    dtype = np.dtype(dtype)
+    time_unit = source_time_unit(traj_file_list(traj_file))
+
+    writer = _HDF5Writer(store_path, dtype, compress, chunk_frames) if hdf5 \
+        else _NpyWriter(store_path, dtype, compress, chunk_frames)
+    timesteps = []
+    boxes = []
+    buffer = []
+    for cols, timestep, cell, data in _iter_source(traj_file, columns, dtype, top, chunk_frames):
+        if writer.columns is None:
+            writer.columns = list(cols)
+            writer.natoms = len(data)
+        elif cols != writer.columns or len(data) != writer.natoms:
+            raise ValueError('Columns or number of atoms change at timestep %s of %s' % (timestep, traj_file))
+        timesteps.append(timestep)
+        boxes.append(cell)
+        buffer.append(data)
+        if len(buffer) == chunk_frames:
+            writer.write_chunk(np.stack(buffer))
+            buffer = []
+    if buffer:
+        writer.write_chunk(np.stack(buffer))
+    if writer.columns is None:
+        raise ValueError('No frames found in %s' % traj_file)
+
+    writer.finish(np.array(timesteps), np.array(boxes, dtype=float).reshape(-1, 3, 3),
+                  [str(f) for f in traj_file_list(traj_file)], time_unit)
+    return TrajStore(store_path)
+
+
+class _NpyWriter():
+    def __init__(self, path, dtype, compress, chunk_frames):
+        self.path = path
+        self.dtype = dtype
+        self.compress = compress
+        self.chunk_frames = chunk_frames
+        self.columns = None
+        self.natoms = None
+        self.chunks = []
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    def write_chunk(self, data):
+        i = len(self.chunks)
+        for j in range(len(self.columns)):
+            col_dir = os.path.join(self.path, 'col%i' % j)
+            os.makedirs(col_dir, exist_ok=True)
+            column = np.ascontiguousarray(data[:, :, j])
+            if self.compress:
+                np.savez_compressed(os.path.join(col_dir, '%06i.npz' % i), data=column)
+            else:
+                np.save(os.path.join(col_dir, '%06i.npy' % i), column)
+        self.chunks.append(len(data))
+
+    def finish(self, timesteps, boxes, source, time_unit):
+        np.save(os.path.join(self.path, 'timesteps.npy'), timesteps)
+        np.save(os.path.join(self.path, 'boxes.npy'), boxes)
+        manifest = {
+            'format': FORMAT,
+            'version': 1,
+            'columns': self.columns,
+            'dtype': self.dtype.str,
+            'natoms': self.natoms,
+            'nframes': int(sum(self.chunks)),
+            'chunks': self.chunks,
+            'compressed': self.compress,
+            'units': 'angstrom',
+            'time_unit': time_unit,
+            'source': source,
+        }
+        # The manifest is written last, so an interrupted conversion is not taken for a store
+        with open(os.path.join(self.path, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+
+class _HDF5Writer():
+    def __init__(self, path, dtype, compress, chunk_frames):
+        self.path = path
+        self.dtype = dtype
+        self.compress = compress
+        self.chunk_frames = chunk_frames
+        self.columns = None
+        self.natoms = None
+        self.nframes = 0
+        self.file = h5py.File(path, 'w')
+
+    def write_chunk(self, data):
+        if self.nframes == 0:
+            for j in range(len(self.columns)):
+                self.file.create_dataset('col%i' % j, shape=(0, self.natoms), maxshape=(None, self.natoms),
+                                         dtype=self.dtype, chunks=(min(self.chunk_frames, len(data)), self.natoms),
+                                         compression='gzip' if self.compress else None)
+        n = len(data)
+        for j in range(len(self.columns)):
+            dset = self.file['col%i' % j]
+            dset.resize(self.nframes + n, axis=0)
+            dset[self.nframes:] = data[:, :, j]
+        self.nframes += n
+
+    def finish(self, timesteps, boxes, source, time_unit):
+        self.file.create_dataset('timesteps', data=timesteps)
+        self.file.create_dataset('boxes', data=boxes)
+        self.file.attrs['columns'] = json.dumps(self.columns)
+        self.file.attrs['natoms'] = self.natoms
+        self.file.attrs['nframes'] = self.nframes
+        self.file.attrs['units'] = 'angstrom'
+        self.file.attrs['time_unit'] = time_unit
+        self.file.attrs['source'] = json.dumps(source)
+        self.file.attrs['format'] = FORMAT
+        self.file.close()
+
+
+class TrajStore():
+    """
+    TrajStore
+
+    Trajectory store written by convert_traj. Columns are read lazily: only the chunks
+    overlapping the requested frames are loaded, and uncompressed .npy chunks are
+    memory-mapped, so reading a few frames or columns of a long trajectory is cheap.
+    Positions and cell vectors are in angstrom. Frame times (timesteps) are in time_unit,
+    'step' for stores converted from dumps and 'ps' for those converted from xtc files.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self.hdf5 = os.path.isfile(self.path)
+        if self.hdf5:
+            if not h5py_avail:
+                raise ImportError('h5py is required to read %s. You can install it by "pip install h5py"' % self.path)
+            self.file = h5py.File(self.path, 'r')
+            self.columns = json.loads(self.file.attrs['columns'])
+            self.natoms = int(self.file.attrs['natoms'])
+            self.nframes = int(self.file.attrs['nframes'])
+            self.timesteps = self.file['timesteps'][()]
+            self.boxes = self.file['boxes'][()]
+            self.time_unit = self.file.attrs.get('time_unit', TIME_UNITS['dump'])
+        else:
+            with open(os.path.join(self.path, MANIFEST)) as f:
+                self.manifest = json.load(f)
+            self.columns = self.manifest['columns']
+            self.natoms = self.manifest['natoms']
+            self.nframes = self.manifest['nframes']
+            self.chunk_starts = np.concatenate([[0], np.cumsum(self.manifest['chunks'])]).astype(int)
+            self.timesteps = np.load(os.path.join(self.path, 'timesteps.npy'))
+            self.boxes = np.load(os.path.join(self.path, 'boxes.npy'))
+            self.time_unit = self.manifest.get('time_unit', TIME_UNITS['dump'])
+
+
+    def __len__(self):
+        return self.nframes
+
+
+    def select(self, tmin=None, tmax=None, step=1):
+        """
+        TrajStore.select
+
+        Indices of frames with tmin <= timestep <= tmax, in the time unit of the store
+
+        Return:
+            List of frame indices
+        """
+        lo = 0 if tmin is None else int(np.searchsorted(self.timesteps, tmin, side='left'))
+        hi = self.nframes if tmax is None else int(np.searchsorted(self.timesteps, tmax, side='right'))
+        return list(range(lo, hi, step))
+
+
+    def times(self, frames=None, time_step=None):
+        """
+        TrajStore.times
+
+        Times of frames in ps
+
+        Optional args:
+            frames: slice or list of frame indices (all frames if None)
+            time_step: Time step of the run in fs, needed for stores converted from dumps (float)
+
+        Return:
+            Array of times in ps
+        """
+        t = self.timesteps[frames if frames is not None else slice(None)]
+        if self.time_unit == 'ps':
+            return np.asarray(t, dtype=float)
+        if time_step is None:
+            raise ValueError('time_step is needed to convert timesteps of %s into ps' % self.path)
+        return np.asarray(t, dtype=float) * time_step * 1e-3
+
+
+    def _chunk(self, j, i):
+        base = os.path.join(self.path, 'col%i' % j, '%06i' % i)
+        if self.manifest['compressed']:
+            with np.load(base + '.npz') as f:
+                return f['data']
+        return np.load(base + '.npy', mmap_mode='r')
+
+
+    def column(self, name, frames=None, atoms=None):
+        """
+        TrajStore.column
+
+        Read one column
+
+        Args:
+            name: Column name
+
+        Optional args:
+            frames: slice or list of frame indices (all frames if None)
+            atoms: slice or list of atom indices, in id order (all atoms if None)
+
+        Return:
+            (frames, atoms) array
+        """
+        j = self.columns.index(name)
+        atoms = slice(None) if atoms is None else atoms
+        index = np.arange(self.nframes)[frames if frames is not None else slice(None)]
+
+        if self.hdf5:
+            dset = self.file['col%i' % j]
+            if frames is None or (isinstance(frames, slice) and frames.step in (None, 1)):
+                data = dset[frames if frames is not None else slice(None)]
+            else:
+                # h5py reads increasing unique indices only
+                unique, inverse = np.unique(index, return_inverse=True)
+                data = dset[unique][inverse]
+            return data[:, atoms]
+
+        chunk_of = np.searchsorted(self.chunk_starts, index, side='right') - 1
+        out = np.empty((len(index), len(np.arange(self.natoms)[atoms])), dtype=np.dtype(self.manifest['dtype']))
+        for i in np.unique(chunk_of):
+            rows = np.nonzero(chunk_of == i)[0]
+            out[rows] = self._chunk(j, i)[index[rows] - self.chunk_starts[i]][:, atoms]
+        return out
+
+
+    def read(self, columns=None, frames=None, atoms=None):
+        """
+        TrajStore.read
+
+        Read a range of frames and columns
+
+        Optional args:
+            columns: List of column names (all if None)
+            frames: slice or list of frame indices (all frames if None)
+            atoms: slice or list of atom indices, in id order (all atoms if None)
+
+        Return:
+            (frames, atoms, columns) array
+        """
+        columns = columns if columns is not None else self.columns
+        return np.stack([self.column(name, frames, atoms) for name in columns], axis=-1)
+
+
+    def positions(self, frames=None, atoms=None):
+        """
+        TrajStore.positions
+
+        Read unwrapped coordinates if stored, otherwise wrapped ones
+
+        Return:
+            (frames, atoms, 3) array in angstrom
+        """
+        for names in (['xu', 'yu', 'zu'], ['x', 'y', 'z']):
+            if all(name in self.columns for name in names):
+                return self.read(names, frames, atoms)
+        raise ValueError('Store %s has no coordinate columns' % self.path)
+
+
+    def close(self):
+        if self.hdf5:
+            self.file.close()
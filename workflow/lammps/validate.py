@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DEFAULT_CACHE_FILE = Path.home() / ".workflow" / "lammps_validation.json"
+
+# Input commands whose first argument is a file read by LAMMPS
+FILE_COMMANDS = ("read_data", "read_restart", "include", "molecule", "read_dump")
+
+def referenced_files(input_file: str, work_dir: str = ".") -> List[str]:
+    """Return the existing files an input reads (data, restart, include, molecule), following includes"""
+    work_dir = Path(work_dir)
+    found = []
+    pending = [input_file]
+    while pending:
+        path = work_dir / pending.pop()
+        if not path.is_file():
+            continue
+        with open(path) as f:
+            for line in f:
+                words = line.split("#")[0].split()
+                if len(words) < 2 or words[0] not in FILE_COMMANDS:
+                    continue
+                name = words[2] if words[0] == "molecule" and len(words) > 2 else words[1]
+                name = name.strip("\"'")
+                if "$" in name or name in found or not (work_dir / name).is_file():
+                    continue
+                found.append(name)
+                if words[0] == "include":
+                    pending.append(name)
+    return found
+
+def binary_key(lmp: str) -> str:
+    """Identify a LAMMPS binary by resolved path, size and mtime"""
+    path = shutil.which(lmp)
+    if path is None:
+        return lmp
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    return f"{path}|{st.st_size}|{st.st_mtime_ns}"
+
+def validation_key(content: str, files: List[Path], command: str, lmp: str = "lmp") -> str:
+    """Hash of an input, the files it reads, the command line and the binary"""
+    digest = hashlib.sha256()
+    for part in (content, command, binary_key(lmp)):
+        digest.update(part.encode())
+    for path in sorted(files):
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def parse_log_errors(text: str) -> List[str]:
+    """Return ERROR lines of a LAMMPS log or screen output"""
+    return [line.strip() for line in text.splitlines() if line.lstrip().startswith("ERROR")]
+
+def skiprun(command: str, cwd: str, timeout: float = 600, exit_codes: tuple = (0,)) -> List[str]:
+    """Run a LAMMPS command line with -skiprun (setup only) in cwd and return its errors
+
+    Exit codes other than exit_codes (e.g. the code of a deliberate quit) count as errors.
+    """
+    log_file = Path(cwd) / "log.skiprun"
+    command = f"{command} -skiprun -screen none -log {shlex.quote(str(log_file))}"
+    try:
+        result = subprocess.run(command, shell=True, cwd=cwd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return [f"Dry run did not finish within {timeout} s"]
+
+    errors = parse_log_errors(log_file.read_text()) if log_file.exists() else []
+    errors += [e for e in parse_log_errors(result.stdout + result.stderr) if e not in errors]
+    if result.returncode not in exit_codes and not errors:
+        output = (result.stdout + result.stderr).strip().splitlines()
+        errors = [f"LAMMPS exited with {result.returncode}"] + output[-5:]
+    return errors
+
+class ValidationCache:
+    """Results of dry runs by validation key, shared by processes through a JSON file"""
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else DEFAULT_CACHE_FILE
+
+    def load(self) -> Dict[str, List[str]]:
+        """Return all cached results"""
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logging.warning(f"Can not read validation cache {self.path}")
+            return {}
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Return the errors of a validated input, or None if it was not validated"""
+        return self.load().get(key)
+
+    def set(self, key: str, errors: List[str]):
+        """Store the errors of a validated input"""
+        results = self.load()
+        results[key] = errors
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(results, f, indent=1)
+        os.replace(tmp_file, self.path)
+
+def dry_run(input_file: str, work_dir: str = ".", lmp: str = "lmp", args: str = "",
+            cache: Optional[ValidationCache] = None, timeout: float = 600) -> List[str]:
+    """Validate an input with `lmp -skiprun` and return the errors found (empty if valid)
+
+    The input and the files it reads are copied into a temporary directory, so
+    nothing written by the dry run ends up next to the real inputs. Results are
+    cached by input hash, so unchanged inputs are not run again.
+    """
+    work_dir = Path(work_dir)
+    files = referenced_files(input_file, str(work_dir))
+    command = f"{lmp} -in {shlex.quote(os.path.basename(input_file))} {args}".strip()
+    key = validation_key((work_dir / input_file).read_text(), [work_dir / f for f in files], command, lmp)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    with tempfile.TemporaryDirectory(prefix="lammps_check_") as tmp:
+        shutil.copy(work_dir / input_file, Path(tmp) / os.path.basename(input_file))
+        for name in files:
+            (Path(tmp) / name).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(work_dir / name, Path(tmp) / name)
+        errors = skiprun(command, tmp, timeout)
+
+    if cache is not None:
+        cache.set(key, errors)
+    return errors